@@ -1,20 +1,44 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, Response
-from fastapi.responses import JSONResponse, RedirectResponse
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse, RedirectResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, IndexModel, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
 import os
+import asyncio
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, EmailStr
-from typing import List, Optional, Dict, Any
+from pydantic import BaseModel, Field, EmailStr, StrictFloat, StrictInt, ValidationError
+from pydantic_core import to_json
+from typing import List, Optional, Dict, Any, Callable, Literal, Union
+from typing_extensions import Annotated, TypedDict
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import base64
+import hashlib
+import heapq
+import io
+import json
+import math
+import operator
+import random
+import threading
+import time
 import uuid
+import zlib
 from datetime import datetime, timezone, timedelta
 import bcrypt
 import jwt
 import httpx
 from google.oauth2 import id_token
 from google.auth.transport import requests as google_requests
+from starlette.concurrency import run_in_threadpool
+import numpy as np
+import orjson
+from PIL import Image, ImageColor, ImageDraw, features as pil_features
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -29,6 +53,17 @@ JWT_SECRET = os.environ.get('JWT_SECRET', 'chromatic-arena-secret-key-2024')
 JWT_ALGORITHM = "HS256"
 JWT_EXPIRATION_DAYS = 7
 
+# Cookie sessions: "db" keeps a user_sessions doc per login, "stateless" issues signed tokens that are
+# checked in-process. SESSION_KEYS is "kid:secret,kid:secret" - the first key signs, all of them verify,
+# so keys rotate by prepending a new one and dropping the old one once its tokens have expired.
+SESSION_MODE = os.environ.get('SESSION_MODE', 'db')
+SESSION_DAYS = 7
+SESSION_KEYS = dict(
+    entry.strip().split(":", 1) for entry in os.environ.get('SESSION_KEYS', '').split(",") if ":" in entry
+) or {"default": JWT_SECRET}
+SESSION_SIGNING_KID = next(iter(SESSION_KEYS))
+SESSION_REVOCATION_SYNC = int(os.environ.get('SESSION_REVOCATION_SYNC', 5))
+
 # Google OAuth stuff
 GOOGLE_CLIENT_ID = os.environ.get('GOOGLE_CLIENT_ID')
 GOOGLE_CLIENT_SECRET = os.environ.get('GOOGLE_CLIENT_SECRET')
@@ -36,7 +71,63 @@ GOOGLE_REDIRECT_URI = os.environ.get('GOOGLE_REDIRECT_URI', 'http://localhost:80
 
 FRONTEND_URL = os.environ.get('FRONTEND_URL', 'http://localhost:5173')
 
-app = FastAPI(title="Chromatic Arena API")
+# Password hashing pool
+PASSWORD_POOL_KIND = os.environ.get('PASSWORD_POOL_KIND', 'thread')
+PASSWORD_POOL_WORKERS = int(os.environ.get('PASSWORD_POOL_WORKERS', os.cpu_count() or 2))
+PASSWORD_MAX_QUEUE = int(os.environ.get('PASSWORD_MAX_QUEUE', 256))
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))
+BCRYPT_REHASH_ON_LOGIN = os.environ.get('BCRYPT_REHASH_ON_LOGIN', 'false').lower() == 'true'
+
+# Auth caches - short TTL bounds staleness across workers
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 20000))
+USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 30))
+
+# Thumbnails
+THUMBNAIL_DIR = Path(os.environ.get('THUMBNAIL_DIR', ROOT_DIR / 'thumbnails'))
+THUMBNAIL_SIZE = int(os.environ.get('THUMBNAIL_SIZE', 256))
+THUMBNAIL_POOL_KIND = os.environ.get('THUMBNAIL_POOL_KIND', 'thread')
+THUMBNAIL_WORKERS = int(os.environ.get('THUMBNAIL_WORKERS', 2))
+THUMBNAIL_QUEUE = int(os.environ.get('THUMBNAIL_QUEUE', 1000))
+
+# Score cache
+SCORE_CACHE_SIZE = int(os.environ.get('SCORE_CACHE_SIZE', 20000))
+SCORE_CACHE_TTL = int(os.environ.get('SCORE_CACHE_TTL', 3600))
+
+# Canvas payload limits, checked before the body is decoded
+CANVAS_MAX_BYTES = int(os.environ.get('CANVAS_MAX_BYTES', 4 * 1024 * 1024))
+CANVAS_MAX_OBJECTS = int(os.environ.get('CANVAS_MAX_OBJECTS', 2000))
+CANVAS_MAX_POINTS = int(os.environ.get('CANVAS_MAX_POINTS', 1000))
+CANVAS_MAX_SIZE = int(os.environ.get('CANVAS_MAX_SIZE', 20000))
+SCORE_BATCH_MAX_BYTES = int(os.environ.get('SCORE_BATCH_MAX_BYTES', 32 * 1024 * 1024))
+
+# Score admission - token buckets (per second / burst) plus a bounded queue in front of the scoring workers
+SCORE_CLIENT_RATE = float(os.environ.get('SCORE_CLIENT_RATE', 5))
+SCORE_CLIENT_BURST = int(os.environ.get('SCORE_CLIENT_BURST', 10))
+SCORE_GLOBAL_RATE = float(os.environ.get('SCORE_GLOBAL_RATE', 200))
+SCORE_GLOBAL_BURST = int(os.environ.get('SCORE_GLOBAL_BURST', 400))
+SCORE_WORKERS = int(os.environ.get('SCORE_WORKERS', os.cpu_count() or 2))
+SCORE_MAX_QUEUE = int(os.environ.get('SCORE_MAX_QUEUE', 64))
+# Reverse proxies whose X-Forwarded-For we believe, so anonymous callers behind them aren't one bucket
+TRUSTED_PROXIES = frozenset(ip.strip() for ip in os.environ.get('TRUSTED_PROXIES', '').split(",") if ip.strip())
+
+# JSON responses - orjson for every response. Handlers that return a FastJSONResponse directly
+# also skip FastAPI's jsonable_encoder walk, which is most of the cost on big lists.
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_NAIVE_UTC | orjson.OPT_SERIALIZE_NUMPY
+STREAM_CHUNK_BYTES = 64 * 1024
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+def dumps_json(value: Any) -> bytes:
+    return orjson.dumps(value, default=_json_default, option=ORJSON_OPTIONS)
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return dumps_json(content)
+
+app = FastAPI(title="Chromatic Arena API", default_response_class=FastJSONResponse)
 api_router = APIRouter(prefix="/api")
 
 logging.basicConfig(level=logging.INFO)
@@ -75,22 +166,119 @@ class ArtMovement(BaseModel):
     tools: List[str]
     scoring_rules: Dict[str, Any]
 
+# Canvases. Scoring only needs a handful of keys per object, so the scoring schema keeps just those
+# and pydantic-core drops Fabric's rendering props (paths, shadows, filters...) while decoding,
+# before they ever become Python objects. Stored canvases keep everything.
+Number = Union[StrictInt, StrictFloat]
+CanvasSize = Annotated[Number, Field(gt=0, le=CANVAS_MAX_SIZE, allow_inf_nan=False)]
+
+class CanvasPoint(TypedDict):
+    x: Number
+    y: Number
+
+class ScoredObject(TypedDict, total=False):
+    type: str
+    fill: Any
+    stroke: Any
+    strokeWidth: Number
+    width: Number
+    height: Number
+    radius: Number
+    scaleX: Number
+    scaleY: Number
+    left: Number
+    top: Number
+    angle: Optional[Number]
+    originX: str
+    originY: str
+    points: Annotated[List[CanvasPoint], Field(max_length=CANVAS_MAX_POINTS)]
+    pathOffset: Optional[CanvasPoint]
+    x1: Number
+    y1: Number
+    x2: Number
+    y2: Number
+
+class ScoredCanvas(TypedDict, total=False):
+    width: CanvasSize
+    height: CanvasSize
+    objects: Annotated[List[ScoredObject], Field(max_length=CANVAS_MAX_OBJECTS)]
+
+# Stored objects keep every Fabric prop, but the ones scoring reads are still type-checked
+class StoredObject(ScoredObject, total=False):
+    __pydantic_config__ = {"extra": "allow"}
+
+# Session canvases carry Fabric's per-object id so later deltas can address them
+class SessionObject(ScoredObject, total=False):
+    id: Union[str, StrictInt]
+
+class SessionCanvas(TypedDict, total=False):
+    width: CanvasSize
+    height: CanvasSize
+    objects: Annotated[List[SessionObject], Field(max_length=CANVAS_MAX_OBJECTS)]
+
+class StoredCanvas(TypedDict, total=False):
+    __pydantic_config__ = {"extra": "allow"}
+    width: CanvasSize
+    height: CanvasSize
+    objects: Annotated[List[StoredObject], Field(max_length=CANVAS_MAX_OBJECTS)]
+
 class ArtworkCreate(BaseModel):
     movement_id: str
-    canvas_data: Dict[str, Any]
+    canvas_data: StoredCanvas
     title: Optional[str] = "Untitled"
 
 
+class PurchaseResponse(BaseModel):
+    tool_id: str
+    coins: int
+    owned: bool = True
+    replayed: bool = False
+
+
+class ChallengeSubmission(BaseModel):
+    canvas_data: ScoredCanvas
+
+
 class ScoreRequest(BaseModel):
-    canvas_data: Dict[str, Any]
+    canvas_data: ScoredCanvas
     movement_id: str
 
+class ScoreBatchRequest(BaseModel):
+    items: List[ScoreRequest]
+
 class ScoreResponse(BaseModel):
     total_score: float
     breakdown: Dict[str, float]
     feedback: List[str]
     bonus: float = 0
 
+class CanvasDelta(BaseModel):
+    op: Literal["add", "modify", "remove"]
+    id: str
+    object: Optional[ScoredObject] = None
+
+class ScoreSessionCreate(BaseModel):
+    movement_id: str
+    canvas_data: SessionCanvas = Field(default_factory=dict)
+
+class ScoreSessionDelta(BaseModel):
+    base_version: Optional[int] = None
+    ops: Annotated[List[CanvasDelta], Field(max_length=CANVAS_MAX_OBJECTS)]
+    width: Optional[CanvasSize] = None
+    height: Optional[CanvasSize] = None
+
+class ScoreSessionResponse(BaseModel):
+    session_id: str
+    version: int
+    score: ScoreResponse
+
+class LiveScoreMessage(BaseModel):
+    type: Literal["canvas", "delta"]
+    seq: Optional[Union[StrictInt, str]] = None
+    movement_id: Optional[str] = None
+    canvas_data: Optional[SessionCanvas] = None
+    ops: Annotated[List[CanvasDelta], Field(max_length=CANVAS_MAX_OBJECTS)] = Field(default_factory=list)
+
 
 class LeaderboardEntry(BaseModel):
     rank: int
@@ -102,12 +290,169 @@ class LeaderboardEntry(BaseModel):
     artworks_count: int
 
 
-def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+# In-process caching
+class LRUTTLCache:
+    # Locked because batch scoring touches it from the threadpool
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Any, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+    
+    def __len__(self) -> int:
+        return len(self._data)
+    
+    def get(self, key: Any, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+    
+    def set(self, key: Any, value: Any):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+    
+    def pop(self, key: Any):
+        with self._lock:
+            self._data.pop(key, None)
+    
+    def purge(self, predicate) -> int:
+        with self._lock:
+            stale = [k for k in self._data if predicate(k)]
+            for k in stale:
+                del self._data[k]
+            return len(stale)
+    
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+    
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+
+def hash_password(password: str, rounds: int = BCRYPT_ROUNDS) -> str:
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
 
 def verify_password(password: str, hashed: str) -> bool:
     return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
 
+def password_rounds(hashed: str) -> int:
+    # $2b$12$... -> 12
+    try:
+        return int(hashed.split("$")[2])
+    except (IndexError, ValueError):
+        return 0
+
+
+# bcrypt is deliberately slow; run it on a pool so a login burst doesn't stall the event loop
+class PasswordPool:
+    def __init__(self, kind: str, workers: int, max_queue: int):
+        self.kind = kind
+        self.workers = workers
+        self.max_queue = max_queue
+        executor_cls = ProcessPoolExecutor if kind == "process" else ThreadPoolExecutor
+        self.executor = executor_cls(max_workers=workers)
+        self.slots = asyncio.Semaphore(workers)
+        self.waiting = 0
+        self.running = 0
+        self.peak_waiting = 0
+        self.completed = 0
+        self.rejected = 0
+        self.rehashed = 0
+    
+    async def run(self, fn, *args):
+        if self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise HTTPException(status_code=503, detail="Authentication is busy, try again shortly", headers={"Retry-After": "1"})
+        self.waiting += 1
+        self.peak_waiting = max(self.peak_waiting, self.waiting)
+        try:
+            await self.slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.running += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        finally:
+            self.running -= 1
+            self.completed += 1
+            self.slots.release()
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "kind": self.kind,
+            "workers": self.workers,
+            "running": self.running,
+            "queue_depth": self.waiting,
+            "peak_queue_depth": self.peak_waiting,
+            "max_queue": self.max_queue,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "rehashed": self.rehashed,
+            "bcrypt_rounds": BCRYPT_ROUNDS
+        }
+    
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+
+password_pool = PasswordPool(PASSWORD_POOL_KIND, PASSWORD_POOL_WORKERS, PASSWORD_MAX_QUEUE)
+background_tasks: set = set()
+
+
+async def hash_password_async(password: str) -> str:
+    return await password_pool.run(hash_password, password)
+
+async def verify_password_async(password: str, hashed: Optional[str]) -> bool:
+    if not hashed:
+        # Google-only accounts have no password
+        return False
+    return await password_pool.run(verify_password, password, hashed)
+
+async def rehash_password(user_id: str, password: str, old_hash: str):
+    # Only swap if the hash hasn't changed underneath us (e.g. a password reset)
+    try:
+        new_hash = await hash_password_async(password)
+        result = await db.users.update_one({"user_id": user_id, "password": old_hash}, {"$set": {"password": new_hash}})
+        if result.modified_count:
+            password_pool.rehashed += 1
+    except Exception as e:
+        logger.error(f"Password rehash failed for {user_id}: {e}")
+
+def spawn_background(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
 
 def create_jwt_token(user_id: str) -> str:
     payload = {
@@ -127,27 +472,191 @@ def verify_jwt_token(token: str) -> Optional[str]:
         return None
 
 
-async def get_current_user(request: Request) -> Optional[dict]:
-    # Check cookie first
-    session_token = request.cookies.get("session_token")
-    if session_token:
-        session = await db.user_sessions.find_one(
+# Read-through caches for the auth path: session_token -> (user_id, expires_at), user_id -> user doc.
+# Unknown tokens are cached as False so junk cookies don't hit Mongo every time.
+session_cache = LRUTTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+user_cache = LRUTTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+
+
+async def load_user(user_id: str) -> Optional[dict]:
+    user = user_cache.get(user_id)
+    if user is None:
+        user = await db.users.find_one(
+            {"user_id": user_id},
+            {"_id": 0, "password": 0, "purchase_keys": 0, "session_generation": 0}
+        )
+        if not user:
+            return None
+        user_cache.set(user_id, user)
+    # Callers are free to mutate what they get back
+    return dict(user)
+
+async def load_session(session_token: str) -> Optional[tuple]:
+    session = session_cache.get(session_token)
+    if session is None:
+        doc = await db.user_sessions.find_one(
             {"session_token": session_token},
             {"_id": 0}
         )
-        if session:
-            expires_at = session.get("expires_at")
+        session = False
+        if doc:
+            expires_at = doc.get("expires_at")
             if isinstance(expires_at, str):
                 expires_at = datetime.fromisoformat(expires_at)
             if expires_at.tzinfo is None:
                 expires_at = expires_at.replace(tzinfo=timezone.utc)
-            
+            session = (doc["user_id"], expires_at)
+        session_cache.set(session_token, session)
+    return session or None
+
+def invalidate_user(user_id: str):
+    # Call after any write to the user document (profile, coins, XP, purchases)
+    user_cache.pop(user_id)
+
+def invalidate_session(session_token: str):
+    session_cache.pop(session_token)
+
+
+# Stateless sessions - the signed token carries user id, expiry and the user's session generation, so
+# checking the cookie needs no Mongo read. Logout revokes one token by sid; bumping the user's generation
+# revokes every token minted before it. Revocations sit in a small TTL'd collection that each worker
+# pulls into memory, so another worker may still honor a revoked token for up to SESSION_REVOCATION_SYNC s.
+DB_SESSION_PREFIX = "session_"
+REVOCATION_SYNC_OVERLAP = 60
+revoked_sessions: Dict[str, datetime] = {}
+revoked_generations: Dict[str, tuple] = {}
+revocations_synced_at: Optional[datetime] = None
+
+
+def create_session_token(user_id: str, generation: int) -> str:
+    claims = {
+        "sub": user_id,
+        "sid": uuid.uuid4().hex[:16],
+        "gen": generation,
+        "exp": datetime.now(timezone.utc) + timedelta(days=SESSION_DAYS)
+    }
+    return jwt.encode(claims, SESSION_KEYS[SESSION_SIGNING_KID], algorithm=JWT_ALGORITHM, headers={"kid": SESSION_SIGNING_KID})
+
+def decode_session_token(token: str) -> Optional[dict]:
+    try:
+        key = SESSION_KEYS.get(jwt.get_unverified_header(token).get("kid"))
+        if key is None:
+            # Signed with a key that has been rotated out
+            return None
+        return jwt.decode(token, key, algorithms=[JWT_ALGORITHM], options={"require": ["exp", "sub", "sid"]})
+    except jwt.InvalidTokenError:
+        return None
+
+def session_revoked(claims: dict) -> bool:
+    if claims["sid"] in revoked_sessions:
+        return True
+    floor = revoked_generations.get(claims["sub"])
+    return floor is not None and claims.get("gen", 0) < floor[0]
+
+def apply_revocation(doc: dict):
+    expires_at = doc["expires_at"]
+    if expires_at.tzinfo is None:
+        expires_at = expires_at.replace(tzinfo=timezone.utc)
+    if "sid" in doc:
+        revoked_sessions[doc["sid"]] = expires_at
+        return
+    current = revoked_generations.get(doc["user_id"])
+    if current is None or doc["generation"] >= current[0]:
+        revoked_generations[doc["user_id"]] = (doc["generation"], expires_at)
+
+async def record_revocation(doc: dict):
+    doc["created_at"] = datetime.now(timezone.utc)
+    # This worker stops honoring the token right away, the others on their next sync
+    apply_revocation(doc)
+    await db.session_revocations.insert_one(doc)
+
+async def revoke_session_token(token: str):
+    claims = decode_session_token(token)
+    if claims:
+        await record_revocation({"sid": claims["sid"], "expires_at": datetime.fromtimestamp(claims["exp"], timezone.utc)})
+
+async def revoke_user_sessions(user_id: str):
+    # Log out everywhere (and what a password change should call): older stateless tokens fail the
+    # generation check, DB sessions are deleted and drop out of session_cache within USER_CACHE_TTL
+    user = await db.users.find_one_and_update(
+        {"user_id": user_id},
+        {"$inc": {"session_generation": 1}},
+        projection={"_id": 0, "session_generation": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if not user:
+        return
+    await record_revocation({
+        "user_id": user_id,
+        "generation": user["session_generation"],
+        # Every token older than the bump has expired by then
+        "expires_at": datetime.now(timezone.utc) + timedelta(days=SESSION_DAYS)
+    })
+    await db.user_sessions.delete_many({"user_id": user_id})
+
+async def sync_revocations():
+    global revocations_synced_at
+    started = datetime.now(timezone.utc)
+    query = {}
+    if revocations_synced_at is not None:
+        # Overlap the window so a worker with a lagging clock can't slip one past us
+        query = {"created_at": {"$gte": revocations_synced_at - timedelta(seconds=REVOCATION_SYNC_OVERLAP)}}
+    for doc in await db.session_revocations.find(query, {"_id": 0}).to_list(length=None):
+        apply_revocation(doc)
+    revocations_synced_at = started
+    
+    # Expired tokens fail on their own, no need to remember them
+    for sid in [sid for sid, expires_at in revoked_sessions.items() if expires_at <= started]:
+        del revoked_sessions[sid]
+    for user_id in [u for u, (_, expires_at) in revoked_generations.items() if expires_at <= started]:
+        del revoked_generations[user_id]
+
+async def watch_session_revocations():
+    while True:
+        await asyncio.sleep(SESSION_REVOCATION_SYNC)
+        try:
+            await sync_revocations()
+        except Exception as e:
+            logger.error(f"Failed to sync session revocations: {e}")
+
+async def create_session(user: dict) -> str:
+    if SESSION_MODE == "stateless":
+        return create_session_token(user["user_id"], user.get("session_generation", 0))
+    session_token = f"{DB_SESSION_PREFIX}{uuid.uuid4().hex}"
+    await db.user_sessions.insert_one({
+        "user_id": user["user_id"],
+        "session_token": session_token,
+        "expires_at": datetime.now(timezone.utc) + timedelta(days=SESSION_DAYS),
+        "created_at": datetime.now(timezone.utc).isoformat()
+    })
+    return session_token
+
+def set_session_cookie(response: Response, session_token: str):
+    response.set_cookie(
+        key="session_token",
+        value=session_token,
+        httponly=True,
+        secure=True,
+        samesite="none",
+        max_age=SESSION_DAYS * 24 * 60 * 60,
+        path="/"
+    )
+
+
+async def get_current_user(request: Request) -> Optional[dict]:
+    # Check cookie first. Both kinds are accepted whatever SESSION_MODE says, so switching modes
+    # doesn't log anyone out.
+    session_token = request.cookies.get("session_token")
+    if session_token and session_token.startswith(DB_SESSION_PREFIX):
+        session = await load_session(session_token)
+        if session:
+            user_id, expires_at = session
             if expires_at > datetime.now(timezone.utc):
-                user = await db.users.find_one(
-                    {"user_id": session["user_id"]},
-                    {"_id": 0, "password": 0}
-                )
-                return user
+                return await load_user(user_id)
+    elif session_token:
+        claims = decode_session_token(session_token)
+        if claims and not session_revoked(claims):
+            return await load_user(claims["sub"])
     
     # Try JWT header
     auth_header = request.headers.get("Authorization")
@@ -155,11 +664,7 @@ async def get_current_user(request: Request) -> Optional[dict]:
         token = auth_header.split(" ")[1]
         user_id = verify_jwt_token(token)
         if user_id:
-            user = await db.users.find_one(
-                {"user_id": user_id},
-                {"_id": 0, "password": 0}
-            )
-            return user
+            return await load_user(user_id)
     
     return None
 
@@ -170,9 +675,30 @@ async def require_auth(request: Request) -> dict:
     return user
 
 
+def json_body(model: type, max_bytes: int = CANVAS_MAX_BYTES):
+    # Canvas bodies: refuse oversized payloads before reading them in full, then decode and
+    # validate in one pass inside pydantic-core instead of json.loads + validation
+    async def read(request: Request):
+        declared = request.headers.get("content-length")
+        if declared and declared.isdigit() and int(declared) > max_bytes:
+            raise HTTPException(status_code=413, detail=f"Payload too large (max {max_bytes} bytes)")
+        chunks = []
+        size = 0
+        async for chunk in request.stream():
+            size += len(chunk)
+            if size > max_bytes:
+                raise HTTPException(status_code=413, detail=f"Payload too large (max {max_bytes} bytes)")
+            chunks.append(chunk)
+        try:
+            return model.model_validate_json(b"".join(chunks))
+        except ValidationError as e:
+            raise RequestValidationError([{**err, "loc": ("body", *err["loc"])} for err in e.errors(include_url=False)])
+    return read
+
+
 # Initialize default data
-async def initialize_art_movements():
-    movements = [
+def art_movements_seed() -> List[dict]:
+    return [
         {
             "movement_id": "minimalism",
             "name": "Minimalism",
@@ -259,15 +785,10 @@ async def initialize_art_movements():
             }
         }
     ]
-    
-    for mov in movements:
-        existing = await db.art_movements.find_one({"movement_id": mov["movement_id"]})
-        if not existing:
-            await db.art_movements.insert_one(mov)
 
 
-async def initialize_tools():
-    tools = [
+def tools_seed() -> List[dict]:
+    return [
         # Free tools
         {"tool_id": "brush-basic", "name": "Basic Brush", "type": "brush", "icon": "brush", "price": 0, "rarity": "Common", "movement_id": None},
         {"tool_id": "eraser-basic", "name": "Basic Eraser", "type": "eraser", "icon": "eraser", "price": 0, "rarity": "Common", "movement_id": None},
@@ -290,14 +811,9 @@ async def initialize_tools():
         {"tool_id": "fragment", "name": "Fragment Tool", "type": "effect", "icon": "layers", "price": 200, "rarity": "Epic", "movement_id": "cubism"},
         {"tool_id": "warp", "name": "Warp Tool", "type": "effect", "icon": "waves", "price": 250, "rarity": "Legendary", "movement_id": "surrealism"},
     ]
-    
-    for t in tools:
-        existing = await db.tools.find_one({"tool_id": t["tool_id"]})
-        if not existing:
-            await db.tools.insert_one(t)
 
-async def initialize_achievements():
-    achievements = [
+def achievements_seed() -> List[dict]:
+    return [
         {"achievement_id": "first-artwork", "name": "First Stroke", "description": "Create your first artwork", "icon": "palette", "reward": 50, "requirement": {"artworks_created": 1}},
         {"achievement_id": "five-artworks", "name": "Creative Soul", "description": "Create 5 artworks", "icon": "image", "reward": 100, "requirement": {"artworks_created": 5}},
         {"achievement_id": "ten-artworks", "name": "Prolific Artist", "description": "Create 10 artworks", "icon": "images", "reward": 200, "requirement": {"artworks_created": 10}},
@@ -308,302 +824,2393 @@ async def initialize_achievements():
         {"achievement_id": "first-like", "name": "Appreciated", "description": "Receive your first like", "icon": "heart", "reward": 25, "requirement": {"likes_received": 1}},
         {"achievement_id": "collector", "name": "Tool Collector", "description": "Purchase 5 tools", "icon": "shopping-bag", "reward": 100, "requirement": {"tools_purchased": 5}},
     ]
-    
-    for achievement in achievements:
-        existing = await db.achievements.find_one({"achievement_id": achievement["achievement_id"]})
-        if not existing:
-            await db.achievements.insert_one(achievement)
 
 
-# Scoring logic - this is where the magic happens
-def calculate_score(canvas_data: Dict[str, Any], movement_id: str, movement_rules: Dict[str, Any]) -> ScoreResponse:
-    total_score = 0.0
-    breakdown = {}
-    feedback = []
-    bonus = 0.0
-    
-    objects = canvas_data.get("objects", [])
-    num_objects = len(objects)
-    
-    # Get colors from canvas
-    colors_used = set()
-    for obj in objects:
-        if "fill" in obj and obj["fill"]:
-            colors_used.add(obj["fill"])
-        if "stroke" in obj and obj["stroke"]:
-            colors_used.add(obj["stroke"])
-    
-    num_colors = len(colors_used)
-    
-    # Calculate negative space
-    canvas_width = canvas_data.get("width", 800)
-    canvas_height = canvas_data.get("height", 600)
-    total_area = canvas_width * canvas_height
-    
-    covered_area = 0
-    for obj in objects:
-        obj_width = obj.get("width", obj.get("radius", 50) * 2)
-        obj_height = obj.get("height", obj.get("radius", 50) * 2)
-        covered_area += obj_width * obj_height * obj.get("scaleX", 1) * obj.get("scaleY", 1)
-    
-    negative_space = max(0, 1 - (covered_area / total_area))
-    
-    # Movement-specific scoring
-    if movement_id == "minimalism":
-        max_colors = movement_rules.get("max_colors", 3)
-        if num_colors <= max_colors:
-            color_score = 30
-            feedback.append("Great color restraint!")
-        else:
-            color_score = max(0, 30 - (num_colors - max_colors) * 10)
-            feedback.append(f"Too many colors ({num_colors}). Try using {max_colors} or fewer.")
-        breakdown["colors"] = color_score
-        total_score += color_score
-        
-        max_elements = movement_rules.get("max_elements", 5)
-        if num_objects <= max_elements:
-            element_score = 30
-            feedback.append("Perfect element count!")
-        else:
-            element_score = max(0, 30 - (num_objects - max_elements) * 6)
-            feedback.append(f"Too many elements ({num_objects}). Keep it simple with {max_elements} or fewer.")
-        breakdown["elements"] = element_score
-        total_score += element_score
-        
-        min_negative = movement_rules.get("min_negative_space", 0.4)
-        if negative_space >= min_negative:
-            space_score = 25
-            feedback.append("Excellent use of negative space!")
-        else:
-            space_score = max(0, 25 * (negative_space / min_negative))
-            feedback.append(f"More negative space needed ({int(negative_space*100)}% vs {int(min_negative*100)}% required)")
-        breakdown["negative_space"] = space_score
-        total_score += space_score
-        
-        geometric_types = ["rect", "circle", "triangle", "polygon", "line"]
-        geometric_count = sum(1 for obj in objects if obj.get("type") in geometric_types)
-        if num_objects > 0 and geometric_count == num_objects:
-            bonus = 15
-            feedback.append("Bonus: All geometric shapes!")
-        breakdown["geometric_bonus"] = bonus
-        
-    elif movement_id == "pop_art":
-        if num_colors >= 3:
-            color_score = min(30, num_colors * 8)
-            feedback.append("Great use of bold colors!")
-        else:
-            color_score = num_colors * 10
-            feedback.append("Add more vibrant colors!")
-        breakdown["colors"] = color_score
-        total_score += color_score
-        
-        # Check for repetition
-        type_counts = {}
-        for obj in objects:
-            t = obj.get("type", "unknown")
-            type_counts[t] = type_counts.get(t, 0) + 1
-        
-        has_repetition = any(count >= 3 for count in type_counts.values())
-        if has_repetition:
-            repetition_score = 25
-            feedback.append("Great repetition pattern!")
-        else:
-            repetition_score = 10
-            feedback.append("Try adding more repetition of elements")
-        breakdown["repetition"] = repetition_score
-        total_score += repetition_score
-        
-        contrast_score = min(25, num_objects * 3)
-        breakdown["contrast"] = contrast_score
-        total_score += contrast_score
-        feedback.append("Good visual impact!")
-        
-        outlined_count = sum(1 for obj in objects if obj.get("stroke") and obj.get("strokeWidth", 0) > 0)
-        if outlined_count > 0:
-            bonus = min(20, outlined_count * 5)
-            feedback.append("Bonus: Nice use of outlines!")
-        breakdown["outline_bonus"] = bonus
-        
-    elif movement_id == "cubism":
-        polygon_types = ["polygon", "triangle", "rect"]
-        polygon_count = sum(1 for obj in objects if obj.get("type") in polygon_types)
-        polygon_score = min(30, polygon_count * 6)
-        breakdown["polygons"] = polygon_score
-        total_score += polygon_score
-        
-        if polygon_count >= 5:
-            feedback.append("Excellent geometric fragmentation!")
-        else:
-            feedback.append("Add more geometric shapes for fragmentation")
-        
-        if num_objects >= 4:
-            overlap_score = 25
-            feedback.append("Good layering of elements!")
-        else:
-            overlap_score = num_objects * 6
-            feedback.append("Try overlapping more shapes")
-        breakdown["overlap"] = overlap_score
-        total_score += overlap_score
-        
-        earth_tones = ["#8B4513", "#2F4F4F", "#DAA520", "#696969", "#A0522D", "#CD853F", "#D2691E"]
-        earth_count = sum(1 for c in colors_used if c.upper() in [e.upper() for e in earth_tones])
-        earth_score = min(25, earth_count * 8)
-        breakdown["earth_tones"] = earth_score
-        total_score += earth_score
-        
-        if earth_count >= 2:
-            feedback.append("Nice use of earth tones!")
-            bonus = 10
-    
-    elif movement_id == "impressionism":
-        if num_colors >= 3:
-            color_score = min(30, num_colors * 7)
-            feedback.append("Beautiful color palette!")
-        else:
-            color_score = num_colors * 10
-            feedback.append("Try adding more soft pastel colors")
-        breakdown["colors"] = color_score
-        total_score += color_score
-        
-        if num_objects >= 10:
-            stroke_score = 30
-            feedback.append("Wonderful brushwork effect!")
-        elif num_objects >= 5:
-            stroke_score = 20
-            feedback.append("Add more brush strokes for texture")
-        else:
-            stroke_score = num_objects * 4
-            feedback.append("Layer more strokes to capture light")
-        breakdown["brushstrokes"] = stroke_score
-        total_score += stroke_score
-        
-        if covered_area / total_area > 0.3:
-            atmosphere_score = 20
-            bonus = 10
-            feedback.append("Bonus: Great atmospheric effect!")
-        else:
-            atmosphere_score = 10
-        breakdown["atmosphere"] = atmosphere_score
-        total_score += atmosphere_score
-        
-    elif movement_id == "surrealism":
-        unique_types = len(set(obj.get("type") for obj in objects))
-        creativity_score = min(30, unique_types * 10)
-        breakdown["creativity"] = creativity_score
-        total_score += creativity_score
-        
-        if unique_types >= 3:
-            feedback.append("Great variety of elements!")
-        else:
-            feedback.append("Try using different element types")
-        
-        if num_objects >= 2:
-            scales = [obj.get("scaleX", 1) * obj.get("scaleY", 1) for obj in objects]
-            scale_variety = max(scales) / max(min(scales), 0.1)
-            if scale_variety > 2:
-                juxtaposition_score = 30
-                feedback.append("Surreal scale distortions!")
-                bonus = 15
-            else:
-                juxtaposition_score = 15
-                feedback.append("Try varying sizes more dramatically")
-        else:
-            juxtaposition_score = 10
-        breakdown["juxtaposition"] = juxtaposition_score
-        total_score += juxtaposition_score
-        
-        color_score = min(20, num_colors * 5)
-        breakdown["dreamlike_colors"] = color_score
-        total_score += color_score
-    
-    else:
-        total_score = min(70, num_objects * 5 + num_colors * 10)
-        breakdown["base"] = total_score
-        feedback.append("Keep creating!")
-    
-    total_score += bonus
-    
-    return ScoreResponse(
-        total_score=round(min(total_score, 150), 1),
-        breakdown={k: round(v, 1) for k, v in breakdown.items()},
-        feedback=feedback,
-        bonus=round(bonus, 1)
-    )
+# collection -> (id field, seed docs)
+SEED_COLLECTIONS = {
+    "art_movements": ("movement_id", art_movements_seed),
+    "tools": ("tool_id", tools_seed),
+    "achievements": ("achievement_id", achievements_seed),
+}
 
+async def seed_collection(name: str, key: str, docs: List[dict], version: str):
+    started = time.perf_counter()
+    # $setOnInsert keeps any edits made to existing docs, same as the old find-then-insert
+    result = await db[name].bulk_write(
+        [UpdateOne({key: doc[key]}, {"$setOnInsert": doc}, upsert=True) for doc in docs],
+        ordered=False
+    )
+    await db.seed_versions.update_one(
+        {"_id": name},
+        {"$set": {"version": version, "seeded_at": datetime.now(timezone.utc)}},
+        upsert=True
+    )
+    logger.info(f"Seeded {name}: {result.upserted_count} new of {len(docs)} in {(time.perf_counter() - started) * 1000:.1f}ms")
 
-# Auth endpoints
-@api_router.post("/auth/register")
-async def register(user_data: UserCreate):
-    # Check if user exists
-    existing = await db.users.find_one({"$or": [
-        {"email": user_data.email},
-        {"username": user_data.username}
-    ]})
-    if existing:
-        raise HTTPException(status_code=400, detail="User already exists")
+async def initialize_default_data():
+    seeds = {}
+    for name, (key, build) in SEED_COLLECTIONS.items():
+        docs = build()
+        seeds[name] = (key, docs, _canonical_hash(docs))
     
-    user_id = f"user_{uuid.uuid4().hex[:12]}"
-    hashed_pw = hash_password(user_data.password)
+    # One read decides whether anything needs writing
+    markers = await db.seed_versions.find({"_id": {"$in": list(seeds)}}).to_list(length=None)
+    applied = {m["_id"]: m.get("version") for m in markers}
     
+    stale = [name for name, (_, _, version) in seeds.items() if applied.get(name) != version]
+    if not stale:
+        logger.info("Seed data up to date")
+        return
+    await asyncio.gather(*(seed_collection(name, *seeds[name]) for name in stale))
+
+
+# Catalog cache - movements and tools only change on seed/admin edits, so keep the
+# serialized response around and let clients revalidate with If-None-Match
+CATALOG_COLLECTIONS = ("art_movements", "tools")
+catalog_cache: Dict[str, tuple] = {}
+catalog_versions: Counter = Counter()
+catalog_etags: Dict[str, str] = {}
+catalog_locks = {name: asyncio.Lock() for name in CATALOG_COLLECTIONS}
+
+async def load_catalog(name: str) -> tuple:
+    docs = await db[name].find({}).to_list(length=None)
+    body = dumps_json(docs)
+    etag = f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+    # Version only moves when the content does, not on every reload
+    if catalog_etags.get(name) != etag:
+        catalog_etags[name] = etag
+        catalog_versions[name] += 1
+    catalog_cache[name] = (catalog_versions[name], etag, body)
+    return catalog_cache[name]
+
+async def get_catalog(name: str) -> tuple:
+    entry = catalog_cache.get(name)
+    if entry is None:
+        # Only one reload per invalidation, the rest wait for it
+        async with catalog_locks[name]:
+            entry = catalog_cache.get(name) or await load_catalog(name)
+    return entry
+
+def invalidate_catalog(name: str):
+    catalog_cache.pop(name, None)
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or any(tag.removeprefix("W/") == etag for tag in candidates)
+
+async def catalog_response(name: str, request: Request) -> Response:
+    version, etag, body = await get_catalog(name)
+    headers = {"ETag": etag, "X-Catalog-Version": str(version), "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("If-None-Match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+# New user provisioning - starter kit is embedded in the user doc, so one insert gives
+# an account its free tools or nothing at all. Prices live in memory too, for purchases.
+TOOL_CATALOG_REFRESH = 60
+tool_catalog: Dict[str, dict] = {}
+starter_tools: List[str] = []
+
+async def load_tool_catalog():
+    global tool_catalog, starter_tools
+    tools = await db.tools.find({}, {"_id": 0}).to_list(length=None)
+    tool_catalog = {t["tool_id"]: t for t in tools}
+    starter_tools = [t["tool_id"] for t in tools if t.get("price", 0) == 0]
+
+def new_user_doc(user_id: str, username: str, email: str, **fields) -> dict:
+    now = datetime.now(timezone.utc).isoformat()
     user_doc = {
         "user_id": user_id,
-        "username": user_data.username,
-        "email": user_data.email,
-        "password": hashed_pw,
+        "username": username,
+        "email": email,
         "level": 1,
         "experience": 0,
         "coins": 100,
-        "avatar": None,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": now,
+        "total_score": 100,
+        "artworks_count": 0,
+        "inventory": [{"tool_id": tool_id, "acquired": now} for tool_id in starter_tools]
     }
+    user_doc.update(fields)
+    return user_doc
+
+async def watch_tool_changes():
+    try:
+        async with db.tools.watch() as stream:
+            async for _ in stream:
+                invalidate_catalog("tools")
+                await load_tool_catalog()
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.info(f"tools change stream unavailable, polling every {TOOL_CATALOG_REFRESH}s: {e}")
+    
+    while True:
+        await asyncio.sleep(TOOL_CATALOG_REFRESH)
+        try:
+            await load_tool_catalog()
+            await load_catalog("tools")
+        except Exception as e:
+            logger.error(f"Failed to refresh tool catalog: {e}")
+
+async def migrate_embedded_inventory():
+    # Fold the old per-tool inventory collection into users.inventory
+    await db.inventory.aggregate([
+        {"$sort": {"acquired": 1}},
+        {"$group": {"_id": "$user_id", "inventory": {"$push": {"tool_id": "$tool_id", "acquired": "$acquired"}}}},
+        {"$project": {"_id": 0, "user_id": "$_id", "inventory": 1}},
+        {"$merge": {
+            "into": "users",
+            "on": "user_id",
+            "whenMatched": [{"$set": {"inventory": {"$ifNull": ["$inventory", "$$new.inventory"]}}}],
+            "whenNotMatched": "discard"
+        }}
+    ]).to_list(length=None)
+
+
+# Leaderboard totals - materialized on the user so the board is an index walk
+LEVEL_XP = 100
+
+# total_score = experience + level * 100, same formula the old leaderboard aggregation used
+TOTAL_SCORE_EXPR = {"$add": [{"$ifNull": ["$experience", 0]}, {"$multiply": [{"$ifNull": ["$level", 1]}, 100]}]}
+
+async def migrate_materialized_totals():
+    await db.users.update_many(
+        {},
+        [{"$set": {
+            "total_score": TOTAL_SCORE_EXPR,
+            "artworks_count": {"$ifNull": ["$artworks_count", 0]}
+        }}]
+    )
+
+async def award_experience(user_id: str, experience: int = 0, artworks: int = 0) -> Optional[dict]:
+    # Every XP/level/artwork-count write goes through here so total_score never drifts
+    user = await db.users.find_one_and_update(
+        {"user_id": user_id},
+        [
+            {"$set": {
+                "experience": {"$add": [{"$ifNull": ["$experience", 0]}, experience]},
+                "artworks_count": {"$add": [{"$ifNull": ["$artworks_count", 0]}, artworks]}
+            }},
+            {"$set": {"level": {"$max": [
+                {"$ifNull": ["$level", 1]},
+                {"$add": [1, {"$floor": {"$divide": ["$experience", LEVEL_XP]}}]}
+            ]}}},
+            {"$set": {"total_score": TOTAL_SCORE_EXPR}}
+        ],
+        projection={"_id": 0, "password": 0, "purchase_keys": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    invalidate_user(user_id)
+    return user
+
+
+# Canvas storage codec - Fabric objects repeat the same keys, so objects sharing a key set
+# are stored column-wise and the whole thing is zlib'd. First byte is the schema version.
+CANVAS_CODEC_VERSION = 1
+CANVAS_ZLIB_LEVEL = 6
+
+
+def _is_constant(column: list) -> bool:
+    # Strict on type so 1 / 1.0 / True don't collapse into each other. Floats (-0.0) and nested values
+    # ({"x": 1} / {"x": 1.0}, key order) are compared in their stored JSON form so decode stays exact.
+    first = column[0]
+    if type(first) in (str, int, bool, type(None)):
+        return all(type(value) is type(first) and value == first for value in column)
+    encoded = json.dumps(first, separators=(",", ":"), ensure_ascii=False)
+    return all(
+        type(value) is type(first) and json.dumps(value, separators=(",", ":"), ensure_ascii=False) == encoded
+        for value in column
+    )
+
+
+def _encode_canvas_v1(canvas_data: Dict[str, Any]) -> dict:
+    objects = canvas_data.get("objects")
+    if not isinstance(objects, list) or not all(isinstance(obj, dict) for obj in objects):
+        return {"canvas": canvas_data}
     
-    await db.users.insert_one(user_doc)
+    # Keep the key position of "objects" so decode gives back the same dict order
+    canvas = {key: (None if key == "objects" else value) for key, value in canvas_data.items()}
+    groups: Dict[tuple, int] = {}
+    columns: List[List[list]] = []
+    order = []
+    for obj in objects:
+        keys = tuple(obj)
+        index = groups.get(keys)
+        if index is None:
+            index = groups[keys] = len(columns)
+            columns.append([[] for _ in keys])
+        for column, value in zip(columns[index], obj.values()):
+            column.append(value)
+        order.append(index)
     
-    # Give them basic tools
-    basic_tools = await db.tools.find({"price": 0}, {"_id": 0}).to_list(100)
-    for tool in basic_tools:
-        await db.inventory.insert_one({
-            "user_id": user_id,
-            "tool_id": tool["tool_id"],
-            "acquired": datetime.now(timezone.utc).isoformat()
+    packed = []
+    for keys, cols in zip(groups, columns):
+        # Defaults like skewX=0 or strokeDashArray=None collapse to a single value
+        packed.append({
+            "keys": list(keys),
+            "cols": [{"const": col[0]} if _is_constant(col) else col for col in cols]
         })
+    return {"canvas": canvas, "groups": packed, "order": order}
+
+
+def _decode_canvas_v1(payload: dict) -> Dict[str, Any]:
+    canvas = payload["canvas"]
+    if "groups" not in payload:
+        return canvas
     
-    token = create_jwt_token(user_id)
+    groups = []
+    for group in payload["groups"]:
+        cols = [col["const"] if isinstance(col, dict) else col for col in group["cols"]]
+        consts = [isinstance(col, dict) for col in group["cols"]]
+        groups.append((group["keys"], cols, consts))
+    cursors = [0] * len(groups)
     
+    objects = []
+    for index in payload["order"]:
+        keys, cols, consts = groups[index]
+        row = cursors[index]
+        cursors[index] += 1
+        objects.append({
+            key: (col if const else col[row]) for key, col, const in zip(keys, cols, consts)
+        })
+    canvas["objects"] = objects
+    return canvas
+
+
+CANVAS_ENCODERS = {1: _encode_canvas_v1}
+CANVAS_DECODERS = {1: _decode_canvas_v1}
+
+
+def encode_canvas(canvas_data: Dict[str, Any], version: int = CANVAS_CODEC_VERSION) -> bytes:
+    payload = json.dumps(CANVAS_ENCODERS[version](canvas_data), separators=(",", ":"), ensure_ascii=False)
+    return bytes([version]) + zlib.compress(payload.encode("utf-8"), CANVAS_ZLIB_LEVEL)
+
+
+def decode_canvas(blob: bytes) -> Dict[str, Any]:
+    decoder = CANVAS_DECODERS.get(blob[0]) if blob else None
+    if decoder is None:
+        raise ValueError(f"Unknown canvas codec version {blob[:1]!r}")
+    return decoder(json.loads(zlib.decompress(blob[1:])))
+
+
+def canvas_preview(canvas_data: Dict[str, Any]) -> Dict[str, Any]:
+    # Just enough for a gallery card, so listing never needs the canvas itself
+    objects = canvas_data.get("objects")
+    first = objects[0] if isinstance(objects, list) and objects and isinstance(objects[0], dict) else {}
+    accent = first.get("fill")
     return {
-        "user_id": user_id,
-        "username": user_data.username,
-        "email": user_data.email,
-        "token": token
+        "background": canvas_data.get("backgroundColor") or canvas_data.get("background"),
+        "accent": accent if isinstance(accent, str) else None
     }
 
-@api_router.post("/auth/login")
-async def login(credentials: UserLogin, response: Response):
-    user = await db.users.find_one({"email": credentials.email}, {"_id": 0})
-    if not user or not verify_password(credentials.password, user["password"]):
-        raise HTTPException(status_code=401, detail="Invalid credentials")
+
+def artwork_canvas(artwork: dict) -> Dict[str, Any]:
+    # Artworks saved before the codec still carry raw canvas_data
+    if artwork.get("canvas_blob") is not None:
+        return decode_canvas(artwork["canvas_blob"])
+    return artwork.get("canvas_data") or {}
+
+
+# Thumbnails - canvases rasterized server-side so listings ship a small image instead of
+# vector data. Files are keyed by a hash of the encoded canvas plus render settings, so a
+# key never changes meaning and can be cached forever.
+THUMBNAIL_RENDER_VERSION = 1
+THUMBNAIL_SUPERSAMPLE = 2
+THUMBNAIL_FORMAT = "WEBP" if pil_features.check("webp") else "PNG"
+THUMBNAIL_MEDIA_TYPE = f"image/{THUMBNAIL_FORMAT.lower()}"
+THUMBNAIL_CACHE_CONTROL = "public, max-age=31536000, immutable"
+THUMBNAIL_ELLIPSE_SEGMENTS = 48
+THUMBNAIL_CURVE_STEPS = 8
+
+
+def thumbnail_key(canvas_blob: bytes) -> str:
+    digest = hashlib.blake2b(canvas_blob, digest_size=16)
+    digest.update(f"|{THUMBNAIL_RENDER_VERSION}|{THUMBNAIL_SIZE}|{THUMBNAIL_FORMAT}".encode("ascii"))
+    return digest.hexdigest()
+
+def thumbnail_path(key: str) -> Path:
+    # Two-level fan-out keeps directories small
+    return THUMBNAIL_DIR / key[:2] / f"{key}.{THUMBNAIL_FORMAT.lower()}"
+
+def thumbnail_url(artwork_id: str, key: Optional[str]) -> Optional[str]:
+    return f"/api/artworks/{artwork_id}/thumbnail?v={key}" if key else None
+
+
+def _paint(value: Any, opacity: float) -> Optional[tuple]:
+    # Gradients only get their first stop; patterns and unparseable colors aren't drawn
+    if isinstance(value, dict):
+        stops = value.get("colorStops") or []
+        value = stops[0].get("color") if stops and isinstance(stops[0], dict) else None
+    if not isinstance(value, str) or not value or value == "transparent":
+        return None
+    try:
+        rgba = ImageColor.getcolor(value, "RGBA")
+    except ValueError:
+        return None
+    return rgba[:3] + (int(rgba[3] * max(0.0, min(1.0, opacity))),)
+
+
+def _flatten_path(commands: list) -> List[List[tuple]]:
+    # Fabric stores absolute M/L/H/V/Q/C/Z commands; curves become short polylines
+    runs: List[List[tuple]] = []
+    x = y = 0.0
+    for command in commands:
+        if not command or not isinstance(command, (list, tuple)):
+            continue
+        op, args = command[0], command[1:]
+        if op == "M" and len(args) >= 2:
+            x, y = args[-2], args[-1]
+            runs.append([(x, y)])
+            continue
+        if not runs:
+            runs.append([(x, y)])
+        run = runs[-1]
+        if op == "Q" and len(args) >= 4:
+            (qx, qy, ex, ey), (sx, sy) = args[:4], (x, y)
+            for step in range(1, THUMBNAIL_CURVE_STEPS + 1):
+                t = step / THUMBNAIL_CURVE_STEPS
+                u = 1 - t
+                run.append((u * u * sx + 2 * u * t * qx + t * t * ex, u * u * sy + 2 * u * t * qy + t * t * ey))
+            x, y = ex, ey
+        elif op == "C" and len(args) >= 6:
+            (c1x, c1y, c2x, c2y, ex, ey), (sx, sy) = args[:6], (x, y)
+            for step in range(1, THUMBNAIL_CURVE_STEPS + 1):
+                t = step / THUMBNAIL_CURVE_STEPS
+                u = 1 - t
+                run.append((
+                    u ** 3 * sx + 3 * u * u * t * c1x + 3 * u * t * t * c2x + t ** 3 * ex,
+                    u ** 3 * sy + 3 * u * u * t * c1y + 3 * u * t * t * c2y + t ** 3 * ey
+                ))
+            x, y = ex, ey
+        elif op == "H" and args:
+            x = args[0]
+            run.append((x, y))
+        elif op == "V" and args:
+            y = args[0]
+            run.append((x, y))
+        elif op == "Z":
+            run.append(run[0])
+        elif len(args) >= 2:
+            # L, and anything exotic approximated by its end point
+            x, y = args[-2], args[-1]
+            run.append((x, y))
+    return runs
+
+
+def _object_outlines(obj: Dict[str, Any]) -> tuple:
+    # -> (polygons to fill, polylines to stroke), in canvas coordinates
+    obj_type = obj.get("type")
+    if obj_type == "path" and isinstance(obj.get("path"), list):
+        runs = _flatten_path(obj["path"])
+        points = [p for run in runs for p in run]
+        if not points:
+            return [], []
+        cx, cy, cos_a, sin_a, _, _ = object_placement(obj)
+        scale_x = obj.get("scaleX", 1)
+        scale_y = obj.get("scaleY", 1)
+        offset = obj.get("pathOffset") or {
+            "x": (min(x for x, _ in points) + max(x for x, _ in points)) / 2,
+            "y": (min(y for _, y in points) + max(y for _, y in points)) / 2,
+        }
+        placed = []
+        for run in runs:
+            local = [((x - offset["x"]) * scale_x, (y - offset["y"]) * scale_y) for x, y in run]
+            placed.append([(cx + x * cos_a - y * sin_a, cy + x * sin_a + y * cos_a) for x, y in local])
+        return placed, placed
     
-    token = create_jwt_token(user["user_id"])
+    kind, params, _, _ = object_shape(obj)
+    if kind == "ellipse":
+        cx, cy, rx, ry, cos_a, sin_a = params
+        outline = []
+        for k in range(THUMBNAIL_ELLIPSE_SEGMENTS):
+            t = 2 * math.pi * k / THUMBNAIL_ELLIPSE_SEGMENTS
+            x, y = rx * math.cos(t), ry * math.sin(t)
+            outline.append((cx + x * cos_a - y * sin_a, cy + x * sin_a + y * cos_a))
+        return [outline], [outline + outline[:1]]
+    if obj_type == "polyline":
+        return [params], [params]
+    return [params], [params + params[:1]]
+
+
+def render_thumbnail(canvas_data: Dict[str, Any], size: int = THUMBNAIL_SIZE) -> Image.Image:
+    width = canvas_data.get("width", 800) or 800
+    height = canvas_data.get("height", 600) or 600
+    scale = size * THUMBNAIL_SUPERSAMPLE / max(width, height)
+    canvas_w = max(1, round(width * scale))
+    canvas_h = max(1, round(height * scale))
     
-    # Create session for cookie auth
-    session_token = f"session_{uuid.uuid4().hex}"
-    await db.user_sessions.insert_one({
-        "user_id": user["user_id"],
-        "session_token": session_token,
-        "expires_at": (datetime.now(timezone.utc) + timedelta(days=7)).isoformat(),
-        "created_at": datetime.now(timezone.utc).isoformat()
-    })
+    background = _paint(canvas_data.get("backgroundColor") or canvas_data.get("background"), 1) or (255, 255, 255, 255)
+    image = Image.new("RGBA", (canvas_w, canvas_h), background)
+    # RGBA draw mode blends translucent paint instead of overwriting
+    draw = ImageDraw.Draw(image, "RGBA")
     
-    response.set_cookie(
-        key="session_token",
-        value=session_token,
-        httponly=True,
-        secure=True,
-        samesite="none",
-        max_age=7 * 24 * 60 * 60,
-        path="/"
+    for obj in canvas_data.get("objects") or []:
+        if not isinstance(obj, dict) or obj.get("visible") is False:
+            continue
+        try:
+            fills, strokes = _object_outlines(obj)
+        except (KeyError, TypeError, ValueError, ZeroDivisionError):
+            continue
+        opacity = obj.get("opacity", 1)
+        opacity = opacity if isinstance(opacity, (int, float)) else 1
+        fill = _paint(obj.get("fill"), opacity)
+        stroke = _paint(obj.get("stroke"), opacity)
+        if obj.get("type") == "line":
+            # object_shape already turned the line into its stroke band
+            fill, stroke = stroke, None
+        stroke_width = obj.get("strokeWidth", 1)
+        stroke_width = stroke_width if isinstance(stroke_width, (int, float)) else 1
+        stroke_px = round(stroke_width * scale * (abs(obj.get("scaleX", 1)) + abs(obj.get("scaleY", 1))) / 2)
+        
+        if fill:
+            for outline in fills:
+                if len(outline) >= 3:
+                    draw.polygon([(x * scale, y * scale) for x, y in outline], fill=fill)
+        if stroke and stroke_width > 0:
+            for run in strokes:
+                if len(run) >= 2:
+                    draw.line([(x * scale, y * scale) for x, y in run], fill=stroke, width=max(1, stroke_px), joint="curve")
+    
+    size_out = (max(1, canvas_w // THUMBNAIL_SUPERSAMPLE), max(1, canvas_h // THUMBNAIL_SUPERSAMPLE))
+    return image.resize(size_out, Image.LANCZOS)
+
+
+def write_thumbnail(canvas_blob: bytes, key: str) -> bytes:
+    # Runs in the thumbnail pool: decode, rasterize, write atomically
+    path = thumbnail_path(key)
+    if path.exists():
+        return path.read_bytes()
+    image = render_thumbnail(decode_canvas(canvas_blob))
+    buffer = io.BytesIO()
+    if THUMBNAIL_FORMAT == "WEBP":
+        image.save(buffer, format="WEBP", quality=80, method=4)
+    else:
+        image.save(buffer, format="PNG", optimize=True)
+    body = buffer.getvalue()
+    
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(f".{uuid.uuid4().hex}.tmp")
+    tmp.write_bytes(body)
+    os.replace(tmp, path)
+    return body
+
+
+class ThumbnailRenderer:
+    # Saves enqueue and return; a few asyncio workers feed an executor. On-demand renders
+    # for the same key share one job.
+    def __init__(self, kind: str, workers: int, max_queue: int):
+        self.kind = kind
+        self.workers = workers
+        self.max_queue = max_queue
+        executor_cls = ProcessPoolExecutor if kind == "process" else ThreadPoolExecutor
+        self.executor = executor_cls(max_workers=workers)
+        self.queue: Optional[asyncio.Queue] = None
+        self.tasks: List[asyncio.Task] = []
+        self.inflight: Dict[str, asyncio.Future] = {}
+        self.rendered = 0
+        self.dropped = 0
+        self.failed = 0
+    
+    def start(self):
+        self.queue = asyncio.Queue(maxsize=self.max_queue)
+        self.tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+    
+    def submit(self, key: str, canvas_blob: bytes) -> bool:
+        if self.queue is None:
+            return False
+        try:
+            self.queue.put_nowait((key, canvas_blob))
+            return True
+        except asyncio.QueueFull:
+            # The thumbnail endpoint renders on demand, so dropping is safe
+            self.dropped += 1
+            return False
+    
+    async def render(self, key: str, canvas_blob: bytes) -> bytes:
+        future = self.inflight.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().run_in_executor(self.executor, write_thumbnail, canvas_blob, key)
+            self.inflight[key] = future
+            future.add_done_callback(lambda _: self.inflight.pop(key, None))
+            self.rendered += 1
+        return await asyncio.shield(future)
+    
+    async def _worker(self):
+        while True:
+            key, canvas_blob = await self.queue.get()
+            try:
+                await self.render(key, canvas_blob)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Thumbnail render failed for {key}: {e}")
+            finally:
+                self.queue.task_done()
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "kind": self.kind,
+            "workers": self.workers,
+            "format": THUMBNAIL_FORMAT,
+            "queue_depth": self.queue.qsize() if self.queue else 0,
+            "max_queue": self.max_queue,
+            "inflight": len(self.inflight),
+            "rendered": self.rendered,
+            "dropped": self.dropped,
+            "failed": self.failed
+        }
+    
+    def shutdown(self):
+        for task in self.tasks:
+            task.cancel()
+        self.executor.shutdown(wait=False)
+
+
+thumbnail_renderer = ThumbnailRenderer(THUMBNAIL_POOL_KIND, THUMBNAIL_WORKERS, THUMBNAIL_QUEUE)
+
+
+# Movement leaderboards - one best-score doc per (movement, user) in movement_bests,
+# plus an in-process top-K window per movement that new bests are merged into
+MOVEMENT_TOP_K = 100
+MOVEMENT_TOP_K_TTL = 30
+ARTWORK_XP_BASE = 10
+
+MOVEMENT_BEST_PROJECTION = {"_id": 0, "user_id": 1, "score": 1, "artwork_id": 1, "title": 1, "thumbnail": 1, "achieved_at": 1}
+MOVEMENT_BEST_SORT = [("score", DESCENDING), ("user_id", ASCENDING)]
+
+# TTL picks up bests written by other workers
+movement_top_k = LRUTTLCache(1024, MOVEMENT_TOP_K_TTL)
+
+
+def movement_best_key(best: dict) -> tuple:
+    return (-best["score"], best["user_id"])
+
+def movement_best_after(movement_id: str, score: float, user_id: str) -> dict:
+    # Seek predicate for everything ranked below (score, user_id)
+    return {"movement_id": movement_id, "$or": [
+        {"score": {"$lt": score}},
+        {"score": score, "user_id": {"$gt": user_id}}
+    ]}
+
+async def load_movement_top_k(movement_id: str) -> List[dict]:
+    top = movement_top_k.get(movement_id)
+    if top is None:
+        top = await db.movement_bests.find(
+            {"movement_id": movement_id}, MOVEMENT_BEST_PROJECTION
+        ).sort(MOVEMENT_BEST_SORT).limit(MOVEMENT_TOP_K).to_list(MOVEMENT_TOP_K)
+        movement_top_k.set(movement_id, top)
+    return top
+
+def offer_movement_top_k(movement_id: str, best: dict):
+    top = movement_top_k.get(movement_id)
+    if top is None:
+        return
+    rest = [entry for entry in top if entry["user_id"] != best["user_id"]]
+    replaced = len(rest) < len(top)
+    # A full window only takes scores that beat its cutoff
+    if len(top) >= MOVEMENT_TOP_K and not replaced and movement_best_key(best) >= movement_best_key(top[-1]):
+        return
+    rest.append(best)
+    rest.sort(key=movement_best_key)
+    # In place, so the entry keeps its original TTL
+    top[:] = rest[:MOVEMENT_TOP_K]
+
+async def record_movement_best(movement_id: str, best: dict) -> bool:
+    # Only replaces a lower score; when the user already has a higher one the upsert
+    # collides with the unique index and we keep the old best
+    try:
+        result = await db.movement_bests.update_one(
+            {"movement_id": movement_id, "user_id": best["user_id"], "score": {"$lt": best["score"]}},
+            {"$set": best},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        return False
+    offer_movement_top_k(movement_id, best)
+    return bool(result.modified_count or result.upserted_id)
+
+def encode_cursor(*values) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(",", ":")).encode("utf-8")).decode("ascii")
+
+def _cursor_value_ok(value: Any, kind: type) -> bool:
+    # Cursors come back from the client, so each value must be the scalar its query compares against
+    if isinstance(value, bool):
+        return False
+    if kind is float:
+        return isinstance(value, (int, float)) and math.isfinite(value)
+    if kind is int:
+        return isinstance(value, int) and value >= 0
+    return isinstance(value, kind)
+
+def decode_cursor(cursor: str, *kinds: type) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (ValueError, TypeError):
+        values = None
+    if (not isinstance(values, list) or len(values) != len(kinds)
+            or not all(_cursor_value_ok(v, k) for v, k in zip(values, kinds))):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+async def stream_json_list(cursor, render: Callable[[dict, int], dict], prefix: bytes = b"",
+                           suffix: Optional[Callable[[Optional[dict], int], bytes]] = None) -> StreamingResponse:
+    # Serialize documents as the cursor hands them over instead of materializing the page with to_list.
+    # The first batch is fetched here so a failing query is still a clean 500, not a truncated 200.
+    try:
+        first = await cursor.next()
+    except StopAsyncIteration:
+        first = None
+    
+    async def body():
+        buf = bytearray(prefix + b"[")
+        last, count = None, 0
+        
+        def emit(doc):
+            nonlocal last, count
+            if count:
+                buf.extend(b",")
+            buf.extend(dumps_json(render(doc, count)))
+            last, count = doc, count + 1
+        
+        try:
+            if first is not None:
+                emit(first)
+                async for doc in cursor:
+                    emit(doc)
+                    if len(buf) >= STREAM_CHUNK_BYTES:
+                        yield bytes(buf)
+                        buf.clear()
+        except Exception as e:
+            logger.error(f"JSON stream aborted after {count} documents: {e}")
+            raise
+        buf.extend(b"]")
+        if suffix:
+            buf.extend(suffix(last, count))
+        yield bytes(buf)
+    
+    return StreamingResponse(body(), media_type="application/json")
+
+
+# Per-user stats - one user_stats doc per user, bumped with $inc/$max as things happen so
+# the profile never aggregates over artworks. rebuild_user_stats recomputes from source.
+USER_STATS_PROJECTION = {"_id": 0}
+
+async def _update_stats(user_id: str, update: dict, event: str) -> List[dict]:
+    update.setdefault("$set", {})["updated_at"] = datetime.now(timezone.utc)
+    stats = await db.user_stats.find_one_and_update(
+        {"user_id": user_id},
+        update,
+        projection={"_id": 0},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return await check_achievements(user_id, event, stats)
+
+async def stats_on_artwork(user_id: str, movement_id: str, score: float, level: int) -> List[dict]:
+    # Artworks are the only source of XP, so a level-up is recorded (and checked) with the artwork event
+    return await _update_stats(user_id, {
+        "$inc": {
+            "artworks_count": 1,
+            "score_sum": score,
+            f"movements.{movement_id}.artworks": 1
+        },
+        "$max": {
+            "best_score": score,
+            f"movements.{movement_id}.best": score,
+            "level": level
+        }
+    }, "artwork")
+
+async def stats_on_like(owner_id: str) -> List[dict]:
+    return await _update_stats(owner_id, {"$inc": {"likes_received": 1}}, "like")
+
+async def stats_on_purchase(user_id: str, tools_owned: int) -> List[dict]:
+    # Only a purchase's first successful write gets here (idempotent replays return earlier), so the
+    # $inc counts each one once; $max because concurrent purchases can report owned counts out of order
+    return await _update_stats(user_id, {
+        "$inc": {"tools_purchased": 1},
+        "$max": {"tools_owned": tools_owned}
+    }, "purchase")
+
+async def rebuild_user_stats(user_id: Optional[str] = None):
+    # Repair path: counters reset from users (granted achievements are kept), then artwork totals merged on top
+    match = {"user_id": user_id} if user_id else {}
+    paid_tools = [t["tool_id"] for t in await db.tools.find({"price": {"$gt": 0}}, {"_id": 0, "tool_id": 1}).to_list(length=None)]
+    now = datetime.now(timezone.utc)
+    
+    await db.users.aggregate([
+        {"$match": match},
+        {"$project": {
+            "_id": 0,
+            "user_id": 1,
+            "level": {"$ifNull": ["$level", 1]},
+            "tools_owned": {"$size": {"$ifNull": ["$inventory", []]}},
+            "tools_purchased": {"$size": {"$filter": {
+                "input": {"$ifNull": ["$inventory", []]},
+                "cond": {"$in": ["$$this.tool_id", paid_tools]}
+            }}},
+            "artworks_count": {"$literal": 0},
+            "score_sum": {"$literal": 0},
+            "best_score": {"$literal": 0},
+            "likes_received": {"$literal": 0},
+            "movements": {"$literal": {}},
+            "updated_at": {"$literal": now}
+        }},
+        {"$merge": {"into": "user_stats", "on": "user_id", "whenMatched": "merge", "whenNotMatched": "insert"}}
+    ]).to_list(length=None)
+    
+    await db.artworks.aggregate([
+        {"$match": match},
+        {"$group": {
+            "_id": {"user_id": "$user_id", "movement_id": "$movement_id"},
+            "artworks": {"$sum": 1},
+            "best": {"$max": "$score"},
+            "score_sum": {"$sum": "$score"},
+            "likes": {"$sum": {"$ifNull": ["$likes", 0]}}
+        }},
+        {"$group": {
+            "_id": "$_id.user_id",
+            "artworks_count": {"$sum": "$artworks"},
+            "score_sum": {"$sum": "$score_sum"},
+            "best_score": {"$max": "$best"},
+            "likes_received": {"$sum": "$likes"},
+            "movements": {"$push": {"k": "$_id.movement_id", "v": {"artworks": "$artworks", "best": "$best"}}}
+        }},
+        {"$project": {
+            "_id": 0,
+            "user_id": "$_id",
+            "artworks_count": 1,
+            "score_sum": 1,
+            "best_score": 1,
+            "likes_received": 1,
+            "movements": {"$arrayToObject": "$movements"}
+        }},
+        {"$merge": {"into": "user_stats", "on": "user_id", "whenMatched": "merge", "whenNotMatched": "discard"}}
+    ]).to_list(length=None)
+
+
+# Achievements - requirements are indexed by the counter they read, and each stats event
+# only re-checks the achievements hanging off the counters it can move. Grants go through
+# a unique (user_id, achievement_id) index, so replays never pay a reward twice.
+ACHIEVEMENT_COUNTERS = {
+    "artworks_created": lambda stats: stats.get("artworks_count", 0),
+    "min_score": lambda stats: stats.get("best_score", 0),
+    "level": lambda stats: stats.get("level", 1),
+    "likes_received": lambda stats: stats.get("likes_received", 0),
+    "tools_purchased": lambda stats: stats.get("tools_purchased", 0),
+    "all_movements": lambda stats: bool(compiled_movements) and all(
+        movement_id in stats.get("movements", {}) for movement_id in compiled_movements
+    ),
+}
+
+ACHIEVEMENT_EVENTS = {
+    "artwork": ("artworks_created", "min_score", "all_movements", "level"),
+    "like": ("likes_received",),
+    "purchase": ("tools_purchased",),
+}
+
+achievement_catalog: Dict[str, dict] = {}
+achievements_by_counter: Dict[str, List[dict]] = {}
+
+
+async def load_achievements():
+    global achievement_catalog, achievements_by_counter
+    achievements = await db.achievements.find({}, {"_id": 0}).to_list(length=None)
+    by_counter: Dict[str, List[dict]] = {}
+    for achievement in achievements:
+        for counter in achievement.get("requirement") or {}:
+            if counter not in ACHIEVEMENT_COUNTERS:
+                logger.warning(f"Achievement {achievement['achievement_id']} uses unknown requirement {counter}")
+                continue
+            by_counter.setdefault(counter, []).append(achievement)
+    achievement_catalog = {a["achievement_id"]: a for a in achievements}
+    achievements_by_counter = by_counter
+
+
+def requirement_met(requirement: Dict[str, Any], stats: dict) -> bool:
+    if not requirement:
+        return False
+    for counter, target in requirement.items():
+        read = ACHIEVEMENT_COUNTERS.get(counter)
+        if read is None:
+            return False
+        value = read(stats)
+        if isinstance(target, bool):
+            if bool(value) != target:
+                return False
+        elif value < target:
+            return False
+    return True
+
+
+async def check_achievements(user_id: str, event: Optional[str], stats: Optional[dict]) -> List[dict]:
+    # event=None re-checks everything (backfill)
+    if not stats:
+        return []
+    counters = ACHIEVEMENT_EVENTS.get(event, ()) if event else ACHIEVEMENT_COUNTERS
+    unlocked = set(stats.get("achievements", []))
+    candidates = {}
+    for counter in counters:
+        for achievement in achievements_by_counter.get(counter, []):
+            if achievement["achievement_id"] not in unlocked:
+                candidates[achievement["achievement_id"]] = achievement
+    earned = [a for a in candidates.values() if requirement_met(a["requirement"], stats)]
+    if not earned:
+        return []
+    return await grant_achievements(user_id, earned)
+
+
+async def grant_achievements(user_id: str, earned: List[dict]) -> List[dict]:
+    now = datetime.now(timezone.utc).isoformat()
+    try:
+        await db.user_achievements.insert_many([
+            {"user_id": user_id, "achievement_id": a["achievement_id"], "reward": a.get("reward", 0), "unlocked_at": now}
+            for a in earned
+        ], ordered=False)
+        granted = earned
+    except BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        if any(err.get("code") != 11000 for err in errors):
+            raise
+        # Already granted elsewhere (another worker, a replayed event)
+        duplicates = {err["index"] for err in errors}
+        granted = [a for i, a in enumerate(earned) if i not in duplicates]
+    
+    await db.user_stats.update_one(
+        {"user_id": user_id},
+        {"$addToSet": {"achievements": {"$each": [a["achievement_id"] for a in earned]}}}
+    )
+    reward = sum(a.get("reward", 0) for a in granted)
+    if reward:
+        await db.users.update_one({"user_id": user_id}, {"$inc": {"coins": reward}})
+        invalidate_user(user_id)
+    return granted
+
+
+async def migrate_achievement_backfill():
+    async for stats in db.user_stats.find({}, {"_id": 0}):
+        await check_achievements(stats["user_id"], None, stats)
+
+
+# Daily challenges - a movement plus tightened versions of its numeric scoring params,
+# drawn from an RNG seeded by the UTC date so every worker lands on the same challenge.
+# Each worker resolves a day once (memory, then Mongo, then generate) and serves it from
+# memory until midnight.
+CHALLENGE_OBJECT_LIMITS = (10, 15, 20, 30)
+CHALLENGE_CONSTRAINT_TEXT = {
+    "max_colors": "Use at most {value} colors",
+    "max_elements": "Keep it to {value} elements or fewer",
+    "min_negative_space": "Leave at least {pct}% of the canvas empty",
+    "min_colors": "Use at least {value} colors",
+    "min_polygons": "Include at least {value} polygons",
+}
+
+daily_challenges: Dict[str, tuple] = {}
+daily_challenge_lock = asyncio.Lock()
+
+
+def challenge_day(now: Optional[datetime] = None) -> str:
+    return (now or datetime.now(timezone.utc)).date().isoformat()
+
+def seconds_until_midnight(now: Optional[datetime] = None) -> int:
+    now = now or datetime.now(timezone.utc)
+    midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time(), tzinfo=timezone.utc)
+    return max(1, int((midnight - now).total_seconds()))
+
+def _tighten(param: str, value: Any, rng: random.Random) -> Any:
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return value
+    if param.startswith("max_"):
+        if isinstance(value, int):
+            return rng.randint(max(1, math.ceil(value * 0.5)), value)
+        return round(value * rng.uniform(0.7, 1.0), 2)
+    if param.startswith("min_"):
+        if isinstance(value, int):
+            return rng.randint(value, max(value, math.ceil(value * 1.5)))
+        return round(min(0.95, value * rng.uniform(1.0, 1.3)), 2)
+    return value
+
+
+def generate_daily_challenge(day: str, movements: List[dict]) -> dict:
+    rng = random.Random(int.from_bytes(hashlib.blake2b(f"daily:{day}".encode("utf-8"), digest_size=8).digest(), "big"))
+    movement = rng.choice(sorted(movements, key=lambda m: m["movement_id"]))
+    movement_id = movement["movement_id"]
+    
+    # Movement docs carry flags and a few numeric params; the builtin spec has the rest
+    rules = dict(movement.get("scoring_rules") or {})
+    params = dict(BUILTIN_SCORING_CRITERIA.get(movement_id, {}).get("params", {}))
+    params.update({k: v for k, v in rules.items() if isinstance(v, (int, float)) and not isinstance(v, bool)})
+    
+    constraints = []
+    for param in sorted(params):
+        value = _tighten(param, params[param], rng)
+        rules[param] = value
+        text = CHALLENGE_CONSTRAINT_TEXT.get(param, "{param}: {value}")
+        constraints.append({
+            "param": param,
+            "value": value,
+            "description": text.format(param=param, value=value, pct=int(value * 100))
+        })
+    max_objects = rng.choice(CHALLENGE_OBJECT_LIMITS)
+    constraints.append({"param": "max_objects", "value": max_objects, "description": f"No more than {max_objects} objects"})
+    
+    return {
+        "challenge_id": f"daily_{day}",
+        "date": day,
+        "movement_id": movement_id,
+        "movement_name": movement.get("name", movement_id),
+        "title": f"{movement.get('name', movement_id)} of the Day",
+        "description": movement.get("description"),
+        "constraints": constraints,
+        "max_objects": max_objects,
+        "scoring_rules": rules,
+        "expires_at": (datetime.fromisoformat(day) + timedelta(days=1)).replace(tzinfo=timezone.utc).isoformat()
+    }
+
+
+async def get_daily_challenge(day: str) -> tuple:
+    # -> (challenge, serialized public body, etag)
+    entry = daily_challenges.get(day)
+    if entry is not None:
+        return entry
+    async with daily_challenge_lock:
+        entry = daily_challenges.get(day)
+        if entry is not None:
+            return entry
+        
+        challenge = await db.daily_challenges.find_one({"date": day}, {"_id": 0})
+        if challenge is None:
+            movements = json.loads((await get_catalog("art_movements"))[2])
+            if not movements:
+                raise HTTPException(status_code=503, detail="No movements available")
+            challenge = generate_daily_challenge(day, movements)
+            # First writer wins, everyone else reads it back
+            await db.daily_challenges.update_one({"date": day}, {"$setOnInsert": challenge}, upsert=True)
+            challenge = await db.daily_challenges.find_one({"date": day}, {"_id": 0})
+        
+        public = {k: v for k, v in challenge.items() if k != "scoring_rules"}
+        body = dumps_json(public)
+        entry = (challenge, body, f'"{challenge["challenge_id"]}"')
+        daily_challenges[day] = entry
+        for stale in [d for d in daily_challenges if d < day]:
+            daily_challenges.pop(stale, None)
+        return entry
+
+
+async def roll_daily_challenges():
+    # Have the new day ready before the midnight rush instead of on its first request
+    while True:
+        try:
+            await get_daily_challenge(challenge_day())
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Failed to prepare daily challenge: {e}")
+        await asyncio.sleep(seconds_until_midnight() + 1)
+
+
+# One-off data migrations, applied in order and recorded in seed_versions
+MIGRATIONS = [
+    ("embedded_inventory", migrate_embedded_inventory),
+    ("materialized_totals", migrate_materialized_totals),
+    ("user_stats", rebuild_user_stats),
+    ("achievement_backfill", migrate_achievement_backfill),
+]
+
+async def run_migrations():
+    names = [name for name, _ in MIGRATIONS]
+    applied = {m["_id"] for m in await db.seed_versions.find({"_id": {"$in": names}}).to_list(length=None)}
+    for name, migrate in MIGRATIONS:
+        if name in applied:
+            continue
+        started = time.perf_counter()
+        await migrate()
+        await db.seed_versions.update_one(
+            {"_id": name},
+            {"$set": {"seeded_at": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+        logger.info(f"Applied migration {name} in {(time.perf_counter() - started) * 1000:.1f}ms")
+
+
+# Index bootstrap - one index per query shape used in this file
+INDEX_SPECS = {
+    "users": [
+        IndexModel([("user_id", ASCENDING)], unique=True, name="user_id_unique"),
+        IndexModel([("email", ASCENDING)], unique=True, name="email_unique"),
+        IndexModel([("username", ASCENDING)], unique=True, name="username_unique"),
+        # user_id breaks ties so ranks are stable
+        IndexModel([("total_score", DESCENDING), ("user_id", ASCENDING)], name="total_score_rank"),
+    ],
+    "user_sessions": [
+        IndexModel([("session_token", ASCENDING)], unique=True, name="session_token_unique"),
+        # Mongo's TTL monitor removes sessions once expires_at has passed
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0, name="expires_at_ttl"),
+    ],
+    "session_revocations": [
+        IndexModel([("created_at", ASCENDING)], name="created_at"),
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0, name="expires_at_ttl"),
+    ],
+    "art_movements": [
+        IndexModel([("movement_id", ASCENDING)], unique=True, name="movement_id_unique"),
+    ],
+    "tools": [
+        IndexModel([("tool_id", ASCENDING)], unique=True, name="tool_id_unique"),
+        IndexModel([("price", ASCENDING)], name="price"),
+    ],
+    "achievements": [
+        IndexModel([("achievement_id", ASCENDING)], unique=True, name="achievement_id_unique"),
+    ],
+    "artworks": [
+        IndexModel([("artwork_id", ASCENDING)], unique=True, name="artwork_id_unique"),
+        IndexModel([("movement_id", ASCENDING), ("score", DESCENDING)], name="movement_score"),
+        IndexModel(
+            [("user_id", ASCENDING), ("created_at", DESCENDING), ("artwork_id", DESCENDING)],
+            name="user_gallery"
+        ),
+    ],
+    "user_stats": [
+        IndexModel([("user_id", ASCENDING)], unique=True, name="user_id_unique"),
+    ],
+    "user_achievements": [
+        IndexModel([("user_id", ASCENDING), ("achievement_id", ASCENDING)], unique=True, name="user_achievement_unique"),
+    ],
+    "daily_challenges": [
+        IndexModel([("date", ASCENDING)], unique=True, name="date_unique"),
+    ],
+    "challenge_entries": [
+        IndexModel([("date", ASCENDING), ("user_id", ASCENDING)], unique=True, name="date_user_unique"),
+        IndexModel([("date", ASCENDING), ("score", DESCENDING), ("user_id", ASCENDING)], name="date_rank"),
+    ],
+    "artwork_likes": [
+        IndexModel([("artwork_id", ASCENDING), ("user_id", ASCENDING)], unique=True, name="artwork_user_unique"),
+    ],
+    "movement_bests": [
+        IndexModel([("movement_id", ASCENDING), ("user_id", ASCENDING)], unique=True, name="movement_user_unique"),
+        IndexModel([("movement_id", ASCENDING), ("score", DESCENDING), ("user_id", ASCENDING)], name="movement_rank"),
+    ],
+}
+
+# IndexOptionsConflict / IndexKeySpecsConflict - same name, different definition
+INDEX_CONFLICT_CODES = (85, 86)
+
+async def migrate_session_expiry():
+    # Older sessions stored expires_at as an ISO string, which a TTL index ignores
+    result = await db.user_sessions.update_many(
+        {"expires_at": {"$type": "string"}},
+        [{"$set": {"expires_at": {"$toDate": "$expires_at"}}}]
+    )
+    if result.modified_count:
+        logger.info(f"Migrated expires_at to datetime on {result.modified_count} sessions")
+
+async def ensure_collection_indexes(name: str, indexes: List[IndexModel]):
+    collection = db[name]
+    for index in indexes:
+        try:
+            await collection.create_indexes([index])
+        except OperationFailure as e:
+            if e.code not in INDEX_CONFLICT_CODES:
+                logger.error(f"Failed to create index {index.document['name']} on {name}: {e}")
+                continue
+            # Definition changed since the last deploy, rebuild it
+            logger.warning(f"Rebuilding index {index.document['name']} on {name}: {e}")
+            try:
+                await collection.drop_index(index.document["name"])
+                await collection.create_indexes([index])
+            except OperationFailure as e:
+                logger.error(f"Failed to rebuild index {index.document['name']} on {name}: {e}")
+    
+    existing = await collection.index_information()
+    missing = [index.document["name"] for index in indexes if index.document["name"] not in existing]
+    if missing:
+        logger.error(f"Missing indexes on {name}: {', '.join(missing)}")
+
+async def ensure_indexes():
+    try:
+        await migrate_session_expiry()
+    except Exception as e:
+        logger.error(f"Session expiry migration failed: {e}")
+    await asyncio.gather(*(
+        ensure_collection_indexes(name, indexes) for name, indexes in INDEX_SPECS.items()
+    ))
+
+
+# Scoring logic - this is where the magic happens
+GEOMETRIC_TYPES = frozenset(["rect", "circle", "triangle", "polygon", "line"])
+POLYGON_TYPES = frozenset(["polygon", "triangle", "rect"])
+
+SCORE_BATCH_LIMIT = 5000
+SCORING_RULES_REFRESH = 60
+
+
+def _canonical_hash(value: Any) -> str:
+    payload = json.dumps(value, sort_keys=True, separators=(",", ":"), default=repr)
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def rules_fingerprint(movement_rules: Dict[str, Any]) -> str:
+    return _canonical_hash(movement_rules)
+
+
+def _hashable(value: Any) -> Any:
+    # Fabric gradients/patterns come through as dicts
+    try:
+        hash(value)
+        return value
+    except TypeError:
+        return repr(value)
+
+
+# Geometry - true union coverage and pairwise overlaps from object positions.
+# Coverage is rasterized on a grid whose resolution is chosen so the total work stays under
+# budget (pixel-accurate on normal canvases, coarser on huge ones). Overlaps go through a
+# uniform-grid spatial index and a separating-axis test on convex outlines.
+COVERAGE_CELL_BUDGET = 480_000
+COVERAGE_WORK_BUDGET = 4_000_000
+SESSION_COVERAGE_CELL_BUDGET = 40_000
+OVERLAP_BUCKETS = 16
+# SAT on two hulls projects every vertex onto every edge, (Va + Vb)^2; budgets are in those units
+OVERLAP_WORK_BUDGET = 2_000_000
+OVERLAP_PAIR_WORK_LIMIT = 40_000
+OVERLAP_EXACT_LIMIT = 400
+ELLIPSE_SEGMENTS = 16
+
+ORIGIN_OFFSETS = {"left": -0.5, "top": -0.5, "center": 0.0, "right": 0.5, "bottom": 0.5}
+
+
+def object_placement(obj: Dict[str, Any]) -> tuple:
+    # -> (center x, center y, cos, sin, scaled width, scaled height)
+    raw_w = obj.get("width", obj.get("radius", 50) * 2)
+    raw_h = obj.get("height", obj.get("radius", 50) * 2)
+    w = raw_w * obj.get("scaleX", 1)
+    h = raw_h * obj.get("scaleY", 1)
+    angle = math.radians(obj.get("angle", 0) or 0)
+    cos_a, sin_a = math.cos(angle), math.sin(angle)
+    
+    # Fabric positions objects by their origin point; find the center
+    ox = ORIGIN_OFFSETS.get(obj.get("originX", "left"), -0.5) * w
+    oy = ORIGIN_OFFSETS.get(obj.get("originY", "top"), -0.5) * h
+    left = obj.get("left", 0)
+    top = obj.get("top", 0)
+    cx = left - (ox * cos_a - oy * sin_a)
+    cy = top - (ox * sin_a + oy * cos_a)
+    return cx, cy, cos_a, sin_a, w, h
+
+
+def object_shape(obj: Dict[str, Any]) -> tuple:
+    # -> (kind, raster params, convex outline for overlap tests, bbox)
+    obj_type = obj.get("type")
+    scale_x = obj.get("scaleX", 1)
+    scale_y = obj.get("scaleY", 1)
+    cx, cy, cos_a, sin_a, w, h = object_placement(obj)
+    
+    def place(points):
+        return [(cx + x * cos_a - y * sin_a, cy + x * sin_a + y * cos_a) for x, y in points]
+    
+    if obj_type in ("circle", "ellipse"):
+        rx, ry = w / 2, h / 2
+        outline = place([
+            (rx * math.cos(2 * math.pi * k / ELLIPSE_SEGMENTS), ry * math.sin(2 * math.pi * k / ELLIPSE_SEGMENTS))
+            for k in range(ELLIPSE_SEGMENTS)
+        ])
+        # Bounding box of a rotated ellipse
+        ex = math.hypot(rx * cos_a, ry * sin_a)
+        ey = math.hypot(rx * sin_a, ry * cos_a)
+        return ("ellipse", (cx, cy, rx, ry, cos_a, sin_a), outline, (cx - ex, cy - ey, cx + ex, cy + ey))
+    
+    if obj_type == "triangle":
+        vertices = place([(0, -h / 2), (w / 2, h / 2), (-w / 2, h / 2)])
+    elif obj_type in ("polygon", "polyline") and obj.get("points"):
+        points = [(p["x"], p["y"]) for p in obj["points"]]
+        offset = obj.get("pathOffset") or {
+            "x": (min(x for x, _ in points) + max(x for x, _ in points)) / 2,
+            "y": (min(y for _, y in points) + max(y for _, y in points)) / 2,
+        }
+        vertices = place([((x - offset["x"]) * scale_x, (y - offset["y"]) * scale_y) for x, y in points])
+    elif obj_type == "line":
+        # A line paints a band strokeWidth thick along the segment
+        raw_w = obj.get("width", obj.get("radius", 50) * 2)
+        raw_h = obj.get("height", obj.get("radius", 50) * 2)
+        x1, y1 = obj.get("x1", -raw_w / 2) * scale_x, obj.get("y1", -raw_h / 2) * scale_y
+        x2, y2 = obj.get("x2", raw_w / 2) * scale_x, obj.get("y2", raw_h / 2) * scale_y
+        length = math.hypot(x2 - x1, y2 - y1) or 1
+        half = max(obj.get("strokeWidth", 1) or 1, 1) / 2
+        nx, ny = -(y2 - y1) / length * half, (x2 - x1) / length * half
+        vertices = place([(x1 + nx, y1 + ny), (x2 + nx, y2 + ny), (x2 - nx, y2 - ny), (x1 - nx, y1 - ny)])
+    else:
+        # Rects, and anything we can't outline exactly (paths, text, images) by their box
+        vertices = place([(-w / 2, -h / 2), (w / 2, -h / 2), (w / 2, h / 2), (-w / 2, h / 2)])
+    
+    xs = [x for x, _ in vertices]
+    ys = [y for _, y in vertices]
+    bbox = (min(xs), min(ys), max(xs), max(ys))
+    if len(vertices) == 4 and obj_type not in ("triangle", "polygon", "polyline", "line") and (obj.get("angle", 0) or 0) % 90 == 0:
+        # Axis-aligned box: cheap raster and exact overlap from the bbox alone
+        return ("box", vertices, vertices, bbox)
+    return ("poly", vertices, _convex_hull(vertices), bbox)
+
+
+def _convex_hull(points: List[tuple]) -> List[tuple]:
+    pts = sorted(set(points))
+    if len(pts) <= 2:
+        return pts
+    
+    def cross(o, a, b):
+        return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+    
+    lower, upper = [], []
+    for p in pts:
+        while len(lower) >= 2 and cross(lower[-2], lower[-1], p) <= 0:
+            lower.pop()
+        lower.append(p)
+    for p in reversed(pts):
+        while len(upper) >= 2 and cross(upper[-2], upper[-1], p) <= 0:
+            upper.pop()
+        upper.append(p)
+    return lower[:-1] + upper[:-1]
+
+
+def _convex_overlap(a: List[tuple], b: List[tuple]) -> bool:
+    # Separating axis test; shapes that only touch don't count as overlapping
+    for poly in (a, b):
+        n = len(poly)
+        for i in range(n):
+            x1, y1 = poly[i]
+            x2, y2 = poly[(i + 1) % n]
+            ax, ay = y1 - y2, x2 - x1
+            if ax == 0 and ay == 0:
+                continue
+            pa = [ax * x + ay * y for x, y in a]
+            pb = [ax * x + ay * y for x, y in b]
+            if max(pa) <= min(pb) or max(pb) <= min(pa):
+                return False
+    return True
+
+
+def _bbox_overlap(a: tuple, b: tuple) -> bool:
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+def coverage_extent(value: float) -> float:
+    # Session and WebSocket canvases aren't schema-checked, so the grid never trusts raw dimensions
+    return min(max(0.0, value), CANVAS_MAX_SIZE)
+
+
+def coverage_cell_size(width: float, height: float, shapes: Optional[List[tuple]] = None, cell_budget: int = COVERAGE_CELL_BUDGET) -> float:
+    width, height = coverage_extent(width), coverage_extent(height)
+    cell = max(1.0, math.sqrt(width * height / cell_budget))
+    if shapes:
+        # Raster work is roughly bbox cells x edges per shape; coarsen until it fits the budget
+        work = 0.0
+        for kind, params, _, (x0, y0, x1, y1) in shapes:
+            area = max(0.0, min(x1, width) - max(x0, 0)) * max(0.0, min(y1, height) - max(y0, 0))
+            work += area * (len(params) if kind == "poly" else 1)
+        cell = max(cell, math.sqrt(work / COVERAGE_WORK_BUDGET))
+    return cell
+
+
+class CoverageIndex:
+    def __init__(self, width: float, height: float, cell: float, track_coverage: bool = True, track_overlaps: bool = True, work_budget: Optional[int] = None):
+        self.width = coverage_extent(width)
+        self.height = coverage_extent(height)
+        self.cell = cell
+        self.track_coverage = track_coverage
+        self.track_overlaps = track_overlaps
+        self.grid_w = max(1, math.ceil(self.width / cell))
+        self.grid_h = max(1, math.ceil(self.height / cell))
+        self.counts = np.zeros((self.grid_h, self.grid_w), dtype=np.uint16) if track_coverage else None
+        self.covered_cells = 0
+        
+        self.bucket_size = max(self.width, self.height, 1) / OVERLAP_BUCKETS
+        self.buckets: Dict[tuple, set] = {}
+        self.neighbors: Dict[Any, set] = {}
+        self.overlap_pairs = 0
+        self.overlapping_objects = 0
+        self.work_left = work_budget if work_budget is not None else math.inf
+        self.shapes: Dict[Any, tuple] = {}
+    
+    @property
+    def covered_area(self) -> float:
+        return min(self.covered_cells * self.cell * self.cell, self.width * self.height)
+    
+    def _raster(self, shape: tuple) -> Optional[tuple]:
+        kind, params, _, (bx0, by0, bx1, by1) = shape
+        c = self.cell
+        x0, x1 = max(0, math.floor(bx0 / c)), min(self.grid_w, math.ceil(bx1 / c))
+        y0, y1 = max(0, math.floor(by0 / c)), min(self.grid_h, math.ceil(by1 / c))
+        if x1 <= x0 or y1 <= y0:
+            return None
+        xs = (np.arange(x0, x1) + 0.5) * c
+        ys = ((np.arange(y0, y1) + 0.5) * c)[:, None]
+        
+        if kind == "box":
+            # Cells whose centers fall inside the box
+            x0, x1 = max(0, math.ceil(bx0 / c - 0.5)), min(self.grid_w, math.floor(bx1 / c - 0.5) + 1)
+            y0, y1 = max(0, math.ceil(by0 / c - 0.5)), min(self.grid_h, math.floor(by1 / c - 0.5) + 1)
+            if x1 <= x0 or y1 <= y0:
+                return None
+            return (slice(y0, y1), slice(x0, x1)), np.ones((y1 - y0, x1 - x0), dtype=bool)
+        
+        if kind == "ellipse":
+            cx, cy, rx, ry, cos_a, sin_a = params
+            if rx <= 0 or ry <= 0:
+                return None
+            dx, dy = xs - cx, ys - cy
+            u = (dx * cos_a + dy * sin_a) / rx
+            v = (dy * cos_a - dx * sin_a) / ry
+            mask = u * u + v * v <= 1
+        else:
+            # Even-odd crossing test, one vectorized pass per edge
+            mask = np.zeros((y1 - y0, x1 - x0), dtype=bool)
+            n = len(params)
+            for i in range(n):
+                xi, yi = params[i]
+                xj, yj = params[i - 1]
+                if yi == yj:
+                    continue
+                spans = (yi > ys) != (yj > ys)
+                x_cross = (xj - xi) * (ys - yi) / (yj - yi) + xi
+                mask ^= spans & (xs < x_cross)
+        return (slice(y0, y1), slice(x0, x1)), mask
+    
+    def _buckets_for(self, bbox: tuple):
+        b = self.bucket_size
+        lo, hi = -1, OVERLAP_BUCKETS
+        x0 = min(max(math.floor(bbox[0] / b), lo), hi)
+        x1 = min(max(math.floor(bbox[2] / b), lo), hi)
+        y0 = min(max(math.floor(bbox[1] / b), lo), hi)
+        y1 = min(max(math.floor(bbox[3] / b), lo), hi)
+        return [(i, j) for i in range(x0, x1 + 1) for j in range(y0, y1 + 1)]
+    
+    def _overlaps(self, a: tuple, b: tuple) -> bool:
+        if not _bbox_overlap(a[3], b[3]):
+            return False
+        kinds = (a[0], b[0])
+        if kinds == ("box", "box"):
+            return True
+        if "ellipse" in kinds:
+            circle, other = (a, b) if a[0] == "ellipse" else (b, a)
+            cx, cy, rx, ry = circle[1][:4]
+            if rx == ry:
+                if other[0] == "ellipse" and other[1][2] == other[1][3]:
+                    ox, oy, orad = other[1][0], other[1][1], other[1][2]
+                    return math.hypot(cx - ox, cy - oy) < rx + orad
+                if other[0] == "box":
+                    x0, y0, x1, y1 = other[3]
+                    return math.hypot(cx - min(max(cx, x0), x1), cy - min(max(cy, y0), y1)) < rx
+        work = (len(a[2]) + len(b[2])) ** 2
+        if work > OVERLAP_PAIR_WORK_LIMIT or work > self.work_left:
+            # High-vertex hulls, or out of budget: fall back to the bounding boxes
+            return True
+        self.work_left -= work
+        return _convex_overlap(a[2], b[2])
+    
+    def add(self, key: Any, shape: tuple):
+        raster = self._raster(shape) if self.track_coverage else None
+        if raster is not None:
+            region, mask = raster
+            view = self.counts[region]
+            self.covered_cells += int(np.count_nonzero(mask & (view == 0)))
+            view += mask
+        
+        buckets = []
+        if self.track_overlaps:
+            buckets = self._buckets_for(shape[3])
+            candidates = set()
+            for bucket in buckets:
+                candidates.update(self.buckets.get(bucket, ()))
+            mine = set()
+            for other in candidates:
+                if self._overlaps(shape, self.shapes[other][0]):
+                    mine.add(other)
+                    if not self.neighbors[other]:
+                        self.overlapping_objects += 1
+                    self.neighbors[other].add(key)
+            if mine:
+                self.overlapping_objects += 1
+            self.overlap_pairs += len(mine)
+            self.neighbors[key] = mine
+            for bucket in buckets:
+                self.buckets.setdefault(bucket, set()).add(key)
+        
+        self.shapes[key] = (shape, raster, buckets)
+    
+    def remove(self, key: Any):
+        shape, raster, buckets = self.shapes.pop(key)
+        if raster is not None:
+            region, mask = raster
+            view = self.counts[region]
+            view -= mask
+            self.covered_cells -= int(np.count_nonzero(mask & (view == 0)))
+        
+        if self.track_overlaps:
+            for bucket in buckets:
+                members = self.buckets[bucket]
+                members.discard(key)
+                if not members:
+                    del self.buckets[bucket]
+            mine = self.neighbors.pop(key)
+            for other in mine:
+                self.neighbors[other].discard(key)
+                if not self.neighbors[other]:
+                    self.overlapping_objects -= 1
+            if mine:
+                self.overlapping_objects -= 1
+            self.overlap_pairs -= len(mine)
+
+
+    def estimate_overlaps(self):
+        # Bounded-cost mode: read overlaps off the raster instead of testing pairs.
+        # An object overlaps if any of its cells is layered; each object adds (deepest layer - 1)
+        # pairs, which is exact for stacks and a slight undercount for chains.
+        layered = 0
+        overlapping = 0
+        for _, raster, _ in self.shapes.values():
+            if raster is None:
+                continue
+            region, mask = raster
+            deepest = int(self.counts[region][mask].max(initial=0))
+            if deepest >= 2:
+                overlapping += 1
+                layered += deepest - 1
+        self.overlapping_objects = overlapping
+        self.overlap_pairs = layered // 2
+
+
+def canvas_geometry(canvas_data: Dict[str, Any], shapes: List[tuple], track_coverage: bool = True, track_overlaps: bool = True) -> CoverageIndex:
+    width = canvas_data.get("width", 800)
+    height = canvas_data.get("height", 600)
+    exact_overlaps = track_overlaps and len(shapes) <= OVERLAP_EXACT_LIMIT
+    raster_overlaps = track_overlaps and not exact_overlaps
+    index = CoverageIndex(
+        width, height,
+        coverage_cell_size(width, height, shapes if track_coverage or raster_overlaps else None),
+        track_coverage or raster_overlaps,
+        exact_overlaps,
+        OVERLAP_WORK_BUDGET
+    )
+    for i, shape in enumerate(shapes):
+        index.add(i, shape)
+    if raster_overlaps:
+        index.estimate_overlaps()
+    return index
+
+
+# Metrics. Base metrics come out of the object walk, grouped by the work needed to get them;
+# derived metrics are computed from base ones.
+METRIC_GROUPS = {
+    "colors": ("num_colors", "palette_count"),
+    "area": ("covered_area", "total_area"),
+    "overlap": ("overlap_pairs", "overlapping_objects"),
+    "types": ("geometric_count", "polygon_count", "max_type_count", "unique_types"),
+    "outline": ("outlined_count",),
+    "scale": ("scale_variety",),
+}
+ALL_METRIC_GROUPS = frozenset(METRIC_GROUPS)
+BASE_METRICS = {"num_objects": None, **{m: group for group, metrics in METRIC_GROUPS.items() for m in metrics}}
+
+DERIVED_METRICS = {
+    # A canvas with no area has nothing to cover, and no negative space to reward either
+    "negative_space": (("covered_area", "total_area"), lambda m: max(0, 1 - (m["covered_area"] / m["total_area"])) if m["total_area"] > 0 else 0),
+    "coverage": (("covered_area", "total_area"), lambda m: m["covered_area"] / m["total_area"] if m["total_area"] > 0 else 0),
+    "all_geometric": (("num_objects", "geometric_count"), lambda m: int(m["num_objects"] > 0 and m["geometric_count"] == m["num_objects"])),
+}
+
+
+# Rule specs. A movement's scoring_rules may carry its own "criteria"; the built-in movements
+# fall back to these. Thresholds and divisors can reference scoring_rules values as "$name".
+# Each criterion picks the first tier whose conditions hold ([metric, op, value], or [op, value]
+# against the criterion's metric). A score is a number or {"base", "per", "offset", "divisor",
+# "terms", "min", "max"}. "kind": "bonus" criteria feed the bonus instead of the total.
+BUILTIN_SCORING_CRITERIA = {
+    "minimalism": {
+        "params": {"max_colors": 3, "max_elements": 5, "min_negative_space": 0.4},
+        "criteria": [
+            {"key": "colors", "metric": "num_colors", "tiers": [
+                {"when": [["<=", "$max_colors"]], "score": 30, "feedback": "Great color restraint!"},
+                {"score": {"base": 30, "per": -10, "offset": "$max_colors", "min": 0},
+                 "feedback": "Too many colors ({value}). Try using {max_colors} or fewer."},
+            ]},
+            {"key": "elements", "metric": "num_objects", "tiers": [
+                {"when": [["<=", "$max_elements"]], "score": 30, "feedback": "Perfect element count!"},
+                {"score": {"base": 30, "per": -6, "offset": "$max_elements", "min": 0},
+                 "feedback": "Too many elements ({value}). Keep it simple with {max_elements} or fewer."},
+            ]},
+            {"key": "negative_space", "metric": "negative_space", "tiers": [
+                {"when": [[">=", "$min_negative_space"]], "score": 25, "feedback": "Excellent use of negative space!"},
+                {"score": {"per": 25, "divisor": "$min_negative_space", "min": 0},
+                 "feedback": "More negative space needed ({value_pct}% vs {min_negative_space_pct}% required)"},
+            ]},
+            {"key": "geometric_bonus", "kind": "bonus", "metric": "all_geometric", "tiers": [
+                {"when": [["==", 1]], "score": 15, "feedback": "Bonus: All geometric shapes!"},
+                {"score": 0},
+            ]},
+        ],
+    },
+    "pop_art": {
+        "params": {"min_colors": 3},
+        "criteria": [
+            {"key": "colors", "metric": "num_colors", "tiers": [
+                {"when": [[">=", "$min_colors"]], "score": {"per": 8, "max": 30}, "feedback": "Great use of bold colors!"},
+                {"score": {"per": 10}, "feedback": "Add more vibrant colors!"},
+            ]},
+            {"key": "repetition", "metric": "max_type_count", "tiers": [
+                {"when": [[">=", 3]], "score": 25, "feedback": "Great repetition pattern!"},
+                {"score": 10, "feedback": "Try adding more repetition of elements"},
+            ]},
+            {"key": "contrast", "metric": "num_objects", "tiers": [
+                {"score": {"per": 3, "max": 25}, "feedback": "Good visual impact!"},
+            ]},
+            {"key": "outline_bonus", "kind": "bonus", "metric": "outlined_count", "tiers": [
+                {"when": [[">", 0]], "score": {"per": 5, "max": 20}, "feedback": "Bonus: Nice use of outlines!"},
+                {"score": 0},
+            ]},
+        ],
+    },
+    "cubism": {
+        "params": {"min_polygons": 5},
+        "palette_colors": ["#8B4513", "#2F4F4F", "#DAA520", "#696969", "#A0522D", "#CD853F", "#D2691E"],
+        "criteria": [
+            {"key": "polygons", "metric": "polygon_count", "tiers": [
+                {"when": [[">=", "$min_polygons"]], "score": {"per": 6, "max": 30}, "feedback": "Excellent geometric fragmentation!"},
+                {"score": {"per": 6, "max": 30}, "feedback": "Add more geometric shapes for fragmentation"},
+            ]},
+            {"key": "overlap", "metric": "overlapping_objects", "tiers": [
+                {"when": [[">=", 4]], "score": 25, "feedback": "Good layering of elements!"},
+                {"score": {"per": 6}, "feedback": "Try overlapping more shapes"},
+            ]},
+            {"key": "earth_tones", "metric": "palette_count", "tiers": [
+                {"when": [[">=", 2]], "score": {"per": 8, "max": 25}, "bonus": 10, "feedback": "Nice use of earth tones!"},
+                {"score": {"per": 8, "max": 25}},
+            ]},
+        ],
+    },
+    "impressionism": {
+        "criteria": [
+            {"key": "colors", "metric": "num_colors", "tiers": [
+                {"when": [[">=", 3]], "score": {"per": 7, "max": 30}, "feedback": "Beautiful color palette!"},
+                {"score": {"per": 10}, "feedback": "Try adding more soft pastel colors"},
+            ]},
+            {"key": "brushstrokes", "metric": "num_objects", "tiers": [
+                {"when": [[">=", 10]], "score": 30, "feedback": "Wonderful brushwork effect!"},
+                {"when": [[">=", 5]], "score": 20, "feedback": "Add more brush strokes for texture"},
+                {"score": {"per": 4}, "feedback": "Layer more strokes to capture light"},
+            ]},
+            {"key": "atmosphere", "metric": "coverage", "tiers": [
+                {"when": [[">", 0.3]], "score": 20, "bonus": 10, "feedback": "Bonus: Great atmospheric effect!"},
+                {"score": 10},
+            ]},
+        ],
+    },
+    "surrealism": {
+        "criteria": [
+            {"key": "creativity", "metric": "unique_types", "tiers": [
+                {"when": [[">=", 3]], "score": {"per": 10, "max": 30}, "feedback": "Great variety of elements!"},
+                {"score": {"per": 10, "max": 30}, "feedback": "Try using different element types"},
+            ]},
+            {"key": "juxtaposition", "metric": "scale_variety", "tiers": [
+                {"when": [["num_objects", ">=", 2], [">", 2]], "score": 30, "bonus": 15, "feedback": "Surreal scale distortions!"},
+                {"when": [["num_objects", ">=", 2]], "score": 15, "feedback": "Try varying sizes more dramatically"},
+                {"score": 10},
+            ]},
+            {"key": "dreamlike_colors", "metric": "num_colors", "tiers": [
+                {"score": {"per": 5, "max": 20}},
+            ]},
+        ],
+    },
+}
+
+DEFAULT_SCORING_CRITERIA = {
+    "criteria": [
+        {"key": "base", "tiers": [
+            {"score": {"terms": {"num_objects": 5, "num_colors": 10}, "max": 70}, "feedback": "Keep creating!"},
+        ]},
+    ],
+}
+
+CONDITION_OPS = {
+    ">=": operator.ge,
+    ">": operator.gt,
+    "<=": operator.le,
+    "<": operator.lt,
+    "==": operator.eq,
+    "!=": operator.ne,
+}
+
+
+class CompiledMovement:
+    # Everything resolved up front so scoring a canvas is a table walk
+    __slots__ = ("movement_id", "fingerprint", "criteria", "palette", "metrics", "groups", "derived", "max_total")
+    
+    def __init__(self, movement_id: str, movement_rules: Dict[str, Any]):
+        self.movement_id = movement_id
+        self.fingerprint = rules_fingerprint(movement_rules)
+        spec = movement_rules if "criteria" in movement_rules else BUILTIN_SCORING_CRITERIA.get(movement_id, DEFAULT_SCORING_CRITERIA)
+        
+        params = dict(spec.get("params", {}))
+        params.update({k: v for k, v in movement_rules.items() if isinstance(v, (int, float)) and not isinstance(v, bool)})
+        self.palette = frozenset(str(c).upper() for c in movement_rules.get("palette_colors", spec.get("palette_colors", [])))
+        self.max_total = float(spec.get("max_total", 150))
+        
+        used = set()
+        criteria = []
+        for criterion in spec["criteria"]:
+            metric = criterion.get("metric")
+            if metric:
+                used.add(metric)
+            tiers = []
+            for tier in criterion["tiers"]:
+                conditions = []
+                for cond in tier.get("when", []):
+                    cond_metric, op, threshold = cond if len(cond) == 3 else (metric, *cond)
+                    if op not in CONDITION_OPS:
+                        raise ValueError(f"Unknown operator {op!r} in {criterion['key']}")
+                    used.add(cond_metric)
+                    conditions.append((cond_metric, CONDITION_OPS[op], self._resolve(threshold, params)))
+                score = self._compile_value(tier.get("score", 0), metric, params, used)
+                bonus = self._compile_value(tier.get("bonus", 0), metric, params, used)
+                template = tier.get("feedback")
+                if template and "{" in template:
+                    if not metric:
+                        raise ValueError(f"Feedback template in {criterion['key']} needs a metric")
+                    context = dict(params)
+                    context.update({f"{k}_pct": int(v * 100) for k, v in params.items()})
+                    template = (template, context)
+                tiers.append((tuple(conditions), score, bonus, template))
+            criteria.append((criterion["key"], metric, criterion.get("kind", "score") == "bonus", tuple(tiers)))
+        self.criteria = tuple(criteria)
+        
+        # Walk the dependency graph down to base metrics so extraction skips what we never read
+        unknown = [m for m in used if m not in BASE_METRICS and m not in DERIVED_METRICS]
+        if unknown:
+            raise ValueError(f"Unknown metrics in scoring rules: {', '.join(sorted(unknown))}")
+        derived = [m for m in DERIVED_METRICS if m in used]
+        base = {m for m in used if m in BASE_METRICS}
+        for m in derived:
+            base.update(DERIVED_METRICS[m][0])
+        self.metrics = frozenset(base)
+        self.groups = frozenset(BASE_METRICS[m] for m in base if BASE_METRICS[m])
+        self.derived = tuple((m, DERIVED_METRICS[m][1]) for m in derived)
+    
+    @staticmethod
+    def _resolve(value: Any, params: Dict[str, Any]) -> Any:
+        if isinstance(value, str) and value.startswith("$"):
+            return params[value[1:]]
+        return value
+    
+    def _compile_value(self, spec: Any, metric: Optional[str], params: Dict[str, Any], used: set) -> tuple:
+        # (constant, base, metric terms, offset, divisor, min, max)
+        if not isinstance(spec, dict):
+            return (True, self._resolve(spec, params), (), 0, 1, None, None)
+        if "terms" in spec:
+            terms = tuple((m, self._resolve(w, params)) for m, w in spec["terms"].items())
+        else:
+            terms = ((metric, self._resolve(spec.get("per", 1), params)),)
+        used.update(m for m, _ in terms)
+        return (
+            False,
+            self._resolve(spec.get("base", 0), params),
+            terms,
+            self._resolve(spec.get("offset", 0), params),
+            self._resolve(spec.get("divisor", 1), params),
+            self._resolve(spec.get("min"), params),
+            self._resolve(spec.get("max"), params),
+        )
+    
+    @staticmethod
+    def _evaluate_value(value: tuple, metrics: Dict[str, Any]) -> float:
+        constant, base, terms, offset, divisor, lo, hi = value
+        if constant:
+            return base
+        result = base
+        for m, weight in terms:
+            x = metrics[m]
+            if offset:
+                x = x - offset
+            if divisor != 1:
+                x = x / divisor
+            result = result + weight * x
+        if hi is not None:
+            result = min(hi, result)
+        if lo is not None:
+            result = max(lo, result)
+        return result
+    
+    def score(self, metrics: Dict[str, Any]) -> ScoreResponse:
+        for name, fn in self.derived:
+            metrics[name] = fn(metrics)
+        
+        total_score = 0.0
+        bonus = 0.0
+        breakdown = {}
+        feedback = []
+        for key, metric, is_bonus, tiers in self.criteria:
+            for conditions, score, tier_bonus, template in tiers:
+                if all(op(metrics[m], threshold) for m, op, threshold in conditions):
+                    points = self._evaluate_value(score, metrics)
+                    extra = self._evaluate_value(tier_bonus, metrics)
+                    if is_bonus:
+                        bonus += points
+                    else:
+                        total_score += points
+                    bonus += extra
+                    breakdown[key] = points
+                    if isinstance(template, tuple):
+                        value = metrics[metric]
+                        feedback.append(template[0].format_map({**template[1], "value": value, "value_pct": int(value * 100)}))
+                    elif template:
+                        feedback.append(template)
+                    break
+        
+        total_score += bonus
+        return ScoreResponse(
+            total_score=round(min(total_score, self.max_total), 1),
+            breakdown={k: round(v, 1) for k, v in breakdown.items()},
+            feedback=feedback,
+            bonus=round(bonus, 1)
+        )
+
+
+compiled_movements: Dict[str, CompiledMovement] = {}
+_compiled_by_fingerprint = LRUTTLCache(256, SCORE_CACHE_TTL)
+
+
+def compile_scoring_rules(movement_id: str, movement_rules: Dict[str, Any]) -> CompiledMovement:
+    key = (movement_id, rules_fingerprint(movement_rules))
+    compiled = _compiled_by_fingerprint.get(key)
+    if compiled is None:
+        compiled = CompiledMovement(movement_id, movement_rules)
+        _compiled_by_fingerprint.set(key, compiled)
+    return compiled
+
+
+def get_compiled_movement(movement_id: str) -> CompiledMovement:
+    compiled = compiled_movements.get(movement_id)
+    if compiled is None:
+        # Unknown movements score with the generic rules
+        compiled = compile_scoring_rules(movement_id, {})
+    return compiled
+
+
+def register_movement_rules(movement: Dict[str, Any]):
+    movement_id = movement["movement_id"]
+    try:
+        compiled_movements[movement_id] = compile_scoring_rules(movement_id, movement.get("scoring_rules") or {})
+    except (KeyError, TypeError, ValueError) as e:
+        # Keep serving the last good version rather than breaking scoring for the movement
+        logger.error(f"Invalid scoring_rules for {movement_id}: {e}")
+
+
+async def load_scoring_rules():
+    movements = await db.art_movements.find({}, {"_id": 0, "movement_id": 1, "scoring_rules": 1}).to_list(length=None)
+    for movement in movements:
+        register_movement_rules(movement)
+    for stale in set(compiled_movements) - {m["movement_id"] for m in movements}:
+        compiled_movements.pop(stale, None)
+
+
+def extract_canvas_metrics(canvas_data: Dict[str, Any], groups: frozenset = ALL_METRIC_GROUPS, palette: frozenset = frozenset()) -> Dict[str, Any]:
+    # Everything the movement rules look at, gathered in a single walk over the objects
+    objects = canvas_data.get("objects", [])
+    num_objects = len(objects)
+    want_colors = "colors" in groups
+    want_area = "area" in groups
+    want_overlap = "overlap" in groups
+    want_types = "types" in groups
+    want_outline = "outline" in groups
+    want_scale = "scale" in groups
+    
+    colors_used = set()
+    type_counts = {}
+    unique_types = set()
+    shapes = []
+    geometric_count = 0
+    polygon_count = 0
+    outlined_count = 0
+    min_scale = None
+    max_scale = None
+    
+    for obj in objects:
+        if want_colors:
+            fill = obj.get("fill")
+            stroke = obj.get("stroke")
+            if fill:
+                colors_used.add(_hashable(fill))
+            if stroke:
+                colors_used.add(_hashable(stroke))
+        
+        if want_area or want_overlap:
+            shapes.append(object_shape(obj))
+        
+        if want_types:
+            obj_type = _hashable(obj.get("type"))
+            unique_types.add(obj_type)
+            t = _hashable(obj.get("type", "unknown"))
+            type_counts[t] = type_counts.get(t, 0) + 1
+            if obj_type in GEOMETRIC_TYPES:
+                geometric_count += 1
+            if obj_type in POLYGON_TYPES:
+                polygon_count += 1
+        if want_outline:
+            if obj.get("stroke") and obj.get("strokeWidth", 0) > 0:
+                outlined_count += 1
+        
+        if want_scale:
+            scale = obj.get("scaleX", 1) * obj.get("scaleY", 1)
+            if min_scale is None or scale < min_scale:
+                min_scale = scale
+            if max_scale is None or scale > max_scale:
+                max_scale = scale
+    
+    canvas_width = canvas_data.get("width", 800)
+    canvas_height = canvas_data.get("height", 600)
+    geometry = canvas_geometry(canvas_data, shapes, want_area, want_overlap) if shapes else None
+    
+    return {
+        "num_objects": num_objects,
+        "num_colors": len(colors_used),
+        "palette_count": sum(1 for c in colors_used if isinstance(c, str) and c.upper() in palette) if palette else 0,
+        "total_area": canvas_width * canvas_height,
+        "covered_area": geometry.covered_area if geometry else 0,
+        "overlap_pairs": geometry.overlap_pairs if geometry else 0,
+        "overlapping_objects": geometry.overlapping_objects if geometry else 0,
+        "geometric_count": geometric_count,
+        "polygon_count": polygon_count,
+        "outlined_count": outlined_count,
+        "max_type_count": max(type_counts.values(), default=0),
+        "unique_types": len(unique_types),
+        "scale_variety": max_scale / max(min_scale, 0.1) if want_scale and num_objects >= 2 else 0.0,
+    }
+
+
+def score_canvas(canvas_data: Dict[str, Any], compiled: CompiledMovement) -> ScoreResponse:
+    return compiled.score(extract_canvas_metrics(canvas_data, compiled.groups, compiled.palette))
+
+
+def calculate_score(canvas_data: Dict[str, Any], movement_id: str, movement_rules: Dict[str, Any]) -> ScoreResponse:
+    return score_canvas(canvas_data, compile_scoring_rules(movement_id, movement_rules))
+
+
+def score_canvases(items: List[tuple]) -> List[ScoreResponse]:
+    # Batches go through the single-canvas path; a failure names the canvas that caused it
+    results = []
+    for i, (canvas_data, compiled) in enumerate(items):
+        try:
+            results.append(score_canvas(canvas_data, compiled))
+        except Exception as e:
+            raise ValueError(f"item {i}: {e!r}") from e
+    return results
+
+
+# Score cache - keyed by what actually affects the score, so undo/redo, restyles and re-submits hit
+SCORED_CANVAS_KEYS = ("width", "height")
+SCORED_OBJECT_KEYS = tuple(ScoredObject.__annotations__)
+
+score_cache = LRUTTLCache(SCORE_CACHE_SIZE, SCORE_CACHE_TTL)
+
+
+def canvas_fingerprint(canvas_data: Dict[str, Any]) -> str:
+    # Key order comes from the tuples above (and the schema, for points), so skip json's sort_keys;
+    # a client that reorders a gradient dict just misses the cache
+    normalized = {k: canvas_data[k] for k in SCORED_CANVAS_KEYS if k in canvas_data}
+    normalized["objects"] = [
+        {k: obj[k] for k in SCORED_OBJECT_KEYS if k in obj}
+        for obj in canvas_data.get("objects", [])
+    ]
+    payload = to_json(normalized, inf_nan_mode="constants", fallback=repr)
+    return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+
+def score_cache_key(canvas_data: Dict[str, Any], compiled: CompiledMovement) -> tuple:
+    return (compiled.movement_id, compiled.fingerprint, canvas_fingerprint(canvas_data))
+
+
+# Score admission - cache hits and identical in-flight canvases are free; real work is charged per canvas
+# to the client and global buckets, and waits in the bounded worker queue
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+    
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+    
+    def take(self, cost: int = 1) -> float:
+        # 0 when admitted, otherwise seconds until a token is available. A cost above one (a batch)
+        # is admitted on one token and leaves the bucket in debt, so later callers pay it off.
+        if cost <= 0:
+            return 0.0
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= cost
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else 60.0
+
+
+class ScoringGate:
+    def __init__(self, workers: int, max_queue: int, client_rate: float, client_burst: int,
+                 global_rate: float, global_burst: int, max_clients: int = 20000):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.client_rate = client_rate
+        self.client_burst = client_burst
+        self.max_clients = max_clients
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="score")
+        self.slots = asyncio.Semaphore(workers)
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.client_buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self.inflight: Dict[tuple, asyncio.Task] = {}
+        self.waiting = 0
+        self.running = 0
+        self.peak_waiting = 0
+        self.cache_hits = 0
+        self.coalesced = 0
+        self.computed = 0
+        self.shed = Counter()
+    
+    def _reject(self, reason: str, retry_after: float):
+        self.shed[reason] += 1
+        raise HTTPException(
+            status_code=429,
+            detail="Too many scoring requests, slow down",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
+    
+    def admit_client(self, client: str, cost: int = 1):
+        bucket = self.client_buckets.get(client)
+        if bucket is None:
+            bucket = self.client_buckets[client] = TokenBucket(self.client_rate, self.client_burst)
+            if len(self.client_buckets) > self.max_clients:
+                self.client_buckets.popitem(last=False)
+        else:
+            self.client_buckets.move_to_end(client)
+        wait = bucket.take(cost)
+        if wait:
+            self._reject("client", wait)
+    
+    def admit(self, client: Optional[str], cost: int = 1):
+        # Raises 429 or takes a queue place; every admit must be followed by run()
+        if client is not None:
+            self.admit_client(client, cost)
+        wait = self.global_bucket.take(cost)
+        if wait:
+            self._reject("global", wait)
+        if self.waiting >= self.max_queue:
+            self._reject("queue", 1)
+        # Counted here rather than in run(), so a burst can't all slip past the check before any of it runs
+        self.waiting += 1
+        self.peak_waiting = max(self.peak_waiting, self.waiting)
+    
+    async def run(self, fn: Callable, *args) -> Any:
+        try:
+            await self.slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.running += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        finally:
+            self.running -= 1
+            self.slots.release()
+    
+    async def submit(self, client: Optional[str], fn: Callable, *args, cost: int = 1) -> Any:
+        # Uncached work (session seeding, deltas, live scoring) through the same admission and workers
+        self.admit(client, cost)
+        return await self.run(fn, *args)
+    
+    async def score(self, client: str, canvas_data: Dict[str, Any], compiled: CompiledMovement) -> ScoreResponse:
+        # Cached and in-flight canvases cost nothing, so they're answered before any bucket is charged
+        key = score_cache_key(canvas_data, compiled)
+        result = score_cache.get(key)
+        if result is not None:
+            self.cache_hits += 1
+            return result
+        
+        task = self.inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.admit(client)
+            # The computation is its own task so a disconnecting leader doesn't cancel it for everyone waiting
+            task = asyncio.create_task(self._compute(key, canvas_data, compiled))
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self.inflight[key] = task
+        return await asyncio.shield(task)
+    
+    async def _compute(self, key: tuple, canvas_data: Dict[str, Any], compiled: CompiledMovement) -> ScoreResponse:
+        try:
+            result = await self.run(score_canvas, canvas_data, compiled)
+            self.computed += 1
+            score_cache.set(key, result)
+            return result
+        finally:
+            self.inflight.pop(key, None)
+    
+    async def score_batch(self, client: str, items: List[tuple]) -> List[ScoreResponse]:
+        # One token per distinct uncached canvas, to both the client and the global bucket
+        # Fingerprinting thousands of canvases is real work too, but it's what makes hits free
+        keys = await run_in_threadpool(lambda: [score_cache_key(canvas_data, compiled) for canvas_data, compiled in items])
+        results: List[Optional[ScoreResponse]] = [score_cache.get(k) for k in keys]
+        misses: Dict[tuple, int] = {}
+        for i, (key, result) in enumerate(zip(keys, results)):
+            if result is None:
+                misses.setdefault(key, i)
+            else:
+                self.cache_hits += 1
+        
+        if misses:
+            computed = await self.submit(client, score_canvases, [items[i] for i in misses.values()], cost=len(misses))
+            self.computed += len(computed)
+            by_key = dict(zip(misses, computed))
+            for key, result in by_key.items():
+                score_cache.set(key, result)
+            results = [by_key[k] if r is None else r for k, r in zip(keys, results)]
+        return results
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "running": self.running,
+            "queue_depth": self.waiting,
+            "peak_queue_depth": self.peak_waiting,
+            "max_queue": self.max_queue,
+            "inflight": len(self.inflight),
+            "cache_hits": self.cache_hits,
+            "coalesced": self.coalesced,
+            "computed": self.computed,
+            "shed": dict(self.shed),
+            "tracked_clients": len(self.client_buckets),
+            "global_tokens": round(self.global_bucket.tokens, 2)
+        }
+    
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+
+scoring_gate = ScoringGate(
+    SCORE_WORKERS, SCORE_MAX_QUEUE,
+    SCORE_CLIENT_RATE, SCORE_CLIENT_BURST,
+    SCORE_GLOBAL_RATE, SCORE_GLOBAL_BURST
+)
+
+
+def client_address(request: Request) -> str:
+    # Walk X-Forwarded-For from the right past our own proxies; the first hop we didn't add is the caller.
+    # Entries left of that are client-supplied and never trusted.
+    address = request.client.host if request.client else "unknown"
+    if address not in TRUSTED_PROXIES:
+        return address
+    for hop in reversed(request.headers.get("x-forwarded-for", "").split(",")):
+        hop = hop.strip()
+        if hop:
+            address = hop
+            if hop not in TRUSTED_PROXIES:
+                break
+    return address
+
+
+async def scoring_client(request: Request) -> str:
+    # Signed-in callers get their own bucket; anonymous ones share one per address
+    user = await get_current_user(request)
+    if user:
+        return f"user:{user['user_id']}"
+    return f"ip:{client_address(request)}"
+
+
+def on_movement_changed(movement: Optional[Dict[str, Any]]):
+    # Recompile and drop scores computed under the old rules; None means "reloaded everything"
+    if movement is None:
+        score_cache.clear()
+        return
+    register_movement_rules(movement)
+    score_cache.purge(lambda key: key[0] == movement["movement_id"])
+
+
+async def watch_movement_changes():
+    # Change streams need a replica set; on a standalone server fall back to polling
+    try:
+        async with db.art_movements.watch(full_document="updateLookup") as stream:
+            async for change in stream:
+                invalidate_catalog("art_movements")
+                doc = change.get("fullDocument")
+                if doc and "movement_id" in doc:
+                    on_movement_changed(doc)
+                else:
+                    await load_scoring_rules()
+                    on_movement_changed(None)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.info(f"art_movements change stream unavailable, polling every {SCORING_RULES_REFRESH}s: {e}")
+    
+    while True:
+        await asyncio.sleep(SCORING_RULES_REFRESH)
+        try:
+            # Old fingerprints simply stop matching, so stale cache entries age out on their own
+            await load_scoring_rules()
+            await load_catalog("art_movements")
+        except Exception as e:
+            logger.error(f"Failed to refresh scoring rules: {e}")
+
+
+# Live scoring sessions - running aggregates per open canvas, so a stroke costs O(delta)
+SCORING_SESSION_TTL = 30 * 60
+SCORING_SESSION_LIMIT = 4000
+
+# Live channel: score once the canvas has been quiet this long, but never hold an update longer than the max
+WS_SCORE_DEBOUNCE = 0.08
+WS_SCORE_MAX_DELAY = 0.5
+
+
+def _object_contribution(obj: Dict[str, Any], with_shape: bool) -> tuple:
+    # Whatever one object adds to the canvas metrics; computed up front so bad input fails before we mutate
+    stroke = obj.get("stroke")
+    colors = [_hashable(c) for c in (obj.get("fill"), stroke) if c]
+    scale_x = obj.get("scaleX", 1)
+    scale_y = obj.get("scaleY", 1)
+    obj_type = _hashable(obj.get("type"))
+    return (
+        colors,
+        object_shape(obj) if with_shape else None,
+        obj_type,
+        _hashable(obj.get("type", "unknown")),
+        obj_type in GEOMETRIC_TYPES,
+        obj_type in POLYGON_TYPES,
+        bool(stroke and obj.get("strokeWidth", 0) > 0),
+        float(scale_x * scale_y),
+    )
+
+
+class ScoringSession:
+    def __init__(self, user_id: str, compiled: CompiledMovement, width: float = 800, height: float = 600):
+        self.session_id = f"score_{uuid.uuid4().hex}"
+        self.user_id = user_id
+        self.compiled = compiled
+        self.width = width
+        self.height = height
+        self.version = 0
+        self.last_used = time.monotonic()
+        # Updates run on worker threads; one at a time per session
+        self.lock = asyncio.Lock()
+        
+        self.objects: Dict[str, tuple] = {}
+        self.colors = Counter()
+        self.variety_types = Counter()
+        self.repetition_types = Counter()
+        self.palette_count = 0
+        self.geometric_count = 0
+        self.polygon_count = 0
+        self.outlined_count = 0
+        # Scale multiset with lazily-pruned heaps for min/max
+        self.scales = Counter()
+        self._min_scales: List[float] = []
+        self._max_scales: List[float] = []
+        self.geometry: Optional[CoverageIndex] = None
+        self._build_geometry()
+    
+    def _build_geometry(self):
+        track_coverage = "area" in self.compiled.groups
+        track_overlaps = "overlap" in self.compiled.groups
+        if not (track_coverage or track_overlaps):
+            return
+        cell = coverage_cell_size(self.width, self.height, cell_budget=SESSION_COVERAGE_CELL_BUDGET)
+        self.geometry = CoverageIndex(self.width, self.height, cell, track_coverage, track_overlaps)
+        for obj_id, contribution in self.objects.items():
+            self.geometry.add(obj_id, contribution[1])
+    
+    def resize(self, width: float, height: float):
+        if (width, height) != (self.width, self.height):
+            self.width = width
+            self.height = height
+            self._build_geometry()
+    
+    def _apply(self, contribution: tuple, sign: int):
+        colors, _, variety_type, repetition_type, geometric, polygon, outlined, scale = contribution
+        for c in colors:
+            before = self.colors[c]
+            self.colors[c] = before + sign
+            if self.colors[c] <= 0:
+                del self.colors[c]
+            if isinstance(c, str) and c.upper() in self.compiled.palette:
+                if before == 0 and sign > 0:
+                    self.palette_count += 1
+                elif before == 1 and sign < 0:
+                    self.palette_count -= 1
+        
+        self.variety_types[variety_type] += sign
+        if self.variety_types[variety_type] <= 0:
+            del self.variety_types[variety_type]
+        self.repetition_types[repetition_type] += sign
+        if self.repetition_types[repetition_type] <= 0:
+            del self.repetition_types[repetition_type]
+        self.geometric_count += sign * geometric
+        self.polygon_count += sign * polygon
+        self.outlined_count += sign * outlined
+        
+        self.scales[scale] += sign
+        if self.scales[scale] <= 0:
+            del self.scales[scale]
+        elif sign > 0 and self.scales[scale] == 1:
+            heapq.heappush(self._min_scales, scale)
+            heapq.heappush(self._max_scales, -scale)
+    
+    def apply_ops(self, ops: List[CanvasDelta]):
+        if any(op.op != "remove" and op.object is None for op in ops):
+            raise ValueError("add/modify ops need an object")
+        with_shape = self.geometry is not None
+        contributions = [_object_contribution(op.object, with_shape) if op.op != "remove" else None for op in ops]
+        for op, contribution in zip(ops, contributions):
+            old = self.objects.get(op.id)
+            if op.op == "add" and old is not None:
+                raise KeyError(f"Object {op.id} already exists")
+            if op.op != "add" and old is None:
+                raise KeyError(f"Unknown object {op.id}")
+            if old is not None:
+                del self.objects[op.id]
+                self._apply(old, -1)
+                if with_shape:
+                    self.geometry.remove(op.id)
+            if contribution is not None:
+                self._apply(contribution, 1)
+                self.objects[op.id] = contribution
+                if with_shape:
+                    self.geometry.add(op.id, contribution[1])
+        self.version += 1
+    
+    def _scale_extremes(self) -> tuple:
+        while self._min_scales and self._min_scales[0] not in self.scales:
+            heapq.heappop(self._min_scales)
+        while self._max_scales and -self._max_scales[0] not in self.scales:
+            heapq.heappop(self._max_scales)
+        return self._min_scales[0], -self._max_scales[0]
+    
+    def metrics(self) -> Dict[str, Any]:
+        num_objects = len(self.objects)
+        total_area = self.width * self.height
+        scale_variety = 0.0
+        if num_objects >= 2:
+            min_scale, max_scale = self._scale_extremes()
+            scale_variety = max_scale / max(min_scale, 0.1)
+        return {
+            "num_objects": num_objects,
+            "num_colors": len(self.colors),
+            "palette_count": self.palette_count,
+            "total_area": total_area,
+            "covered_area": self.geometry.covered_area if self.geometry else 0,
+            "overlap_pairs": self.geometry.overlap_pairs if self.geometry else 0,
+            "overlapping_objects": self.geometry.overlapping_objects if self.geometry else 0,
+            "geometric_count": self.geometric_count,
+            "polygon_count": self.polygon_count,
+            "outlined_count": self.outlined_count,
+            "max_type_count": max(self.repetition_types.values(), default=0),
+            "unique_types": len(self.variety_types),
+            "scale_variety": scale_variety,
+        }
+    
+    def score(self) -> ScoreResponse:
+        return self.compiled.score(self.metrics())
+
+
+def seed_scoring_session(user_id: str, compiled: CompiledMovement, canvas_data: Dict[str, Any]) -> ScoringSession:
+    # Seed from a full, already validated canvas; objects without a client id are keyed by position
+    session = ScoringSession(user_id, compiled, canvas_data.get("width", 800), canvas_data.get("height", 600))
+    session.apply_ops([
+        CanvasDelta.model_construct(op="add", id=str(obj.get("id", i)), object=obj)
+        for i, obj in enumerate(canvas_data.get("objects", []))
+    ])
+    return session
+
+
+def update_scoring_session(session: ScoringSession, delta: ScoreSessionDelta):
+    if delta.width is not None or delta.height is not None:
+        session.resize(delta.width or session.width, delta.height or session.height)
+    session.apply_ops(delta.ops)
+
+
+scoring_sessions: "OrderedDict[str, ScoringSession]" = OrderedDict()
+
+
+def store_scoring_session(session: ScoringSession):
+    now = time.monotonic()
+    while scoring_sessions:
+        oldest = next(iter(scoring_sessions.values()))
+        if len(scoring_sessions) < SCORING_SESSION_LIMIT and now - oldest.last_used < SCORING_SESSION_TTL:
+            break
+        scoring_sessions.popitem(last=False)
+    scoring_sessions[session.session_id] = session
+
+
+def get_scoring_session(session_id: str, user_id: str) -> ScoringSession:
+    session = scoring_sessions.get(session_id)
+    if not session or session.user_id != user_id:
+        raise HTTPException(status_code=404, detail="Scoring session not found")
+    if time.monotonic() - session.last_used > SCORING_SESSION_TTL:
+        scoring_sessions.pop(session_id, None)
+        raise HTTPException(status_code=404, detail="Scoring session expired")
+    session.last_used = time.monotonic()
+    scoring_sessions.move_to_end(session_id)
+    return session
+
+
+# Auth endpoints
+@api_router.post("/auth/register")
+async def register(user_data: UserCreate):
+    # Check if user exists
+    existing = await db.users.find_one({"$or": [
+        {"email": user_data.email},
+        {"username": user_data.username}
+    ]})
+    if existing:
+        raise HTTPException(status_code=400, detail="User already exists")
+    
+    user_id = f"user_{uuid.uuid4().hex[:12]}"
+    hashed_pw = await hash_password_async(user_data.password)
+    
+    user_doc = new_user_doc(
+        user_id,
+        user_data.username,
+        user_data.email,
+        password=hashed_pw,
+        avatar=None
     )
     
+    try:
+        await db.users.insert_one(user_doc)
+    except DuplicateKeyError:
+        # Lost a race with a concurrent registration
+        raise HTTPException(status_code=400, detail="User already exists")
+    
+    token = create_jwt_token(user_id)
+    
+    return {
+        "user_id": user_id,
+        "username": user_data.username,
+        "email": user_data.email,
+        "token": token
+    }
+
+@api_router.post("/auth/login")
+async def login(credentials: UserLogin, response: Response):
+    user = await db.users.find_one({"email": credentials.email}, {"_id": 0})
+    if not user or not await verify_password_async(credentials.password, user.get("password")):
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    
+    if BCRYPT_REHASH_ON_LOGIN and password_rounds(user["password"]) < BCRYPT_ROUNDS:
+        spawn_background(rehash_password(user["user_id"], credentials.password, user["password"]))
+    
+    token = create_jwt_token(user["user_id"])
+    
+    # Create session for cookie auth
+    set_session_cookie(response, await create_session(user))
+    
     return {
         "user_id": user["user_id"],
         "username": user["username"],
@@ -685,53 +3292,26 @@ async def google_callback(code: str, response: Response):
             {"$set": {"name": name, "avatar": picture}}
         )
         user_id = user["user_id"]
+        invalidate_user(user_id)
     else:
         # Create new
         user_id = f"user_{uuid.uuid4().hex[:12]}"
         username = email.split("@")[0] + "_" + uuid.uuid4().hex[:4]
         
-        user_doc = {
-            "user_id": user_id,
-            "username": username,
-            "email": email,
-            "name": name,
-            "password": None,
-            "level": 1,
-            "experience": 0,
-            "coins": 100,
-            "avatar": picture,
-            "created_at": datetime.now(timezone.utc).isoformat()
-        }
+        user_doc = new_user_doc(
+            user_id,
+            username,
+            email,
+            name=name,
+            password=None,
+            avatar=picture
+        )
         await db.users.insert_one(user_doc)
         
-        # Initial inventory
-        basic_tools = await db.tools.find({"price": 0}, {"_id": 0}).to_list(100)
-        for tool in basic_tools:
-            await db.inventory.insert_one({
-                "user_id": user_id,
-                "tool_id": tool["tool_id"],
-                "acquired": datetime.now(timezone.utc).isoformat()
-            })
-        
         user = user_doc
     
-    session_token = f"session_{uuid.uuid4().hex}"
-    await db.user_sessions.insert_one({
-        "user_id": user_id,
-        "session_token": session_token,
-        "expires_at": (datetime.now(timezone.utc) + timedelta(days=7)).isoformat(),
-        "created_at": datetime.now(timezone.utc).isoformat()
-    })
-    
-    response.set_cookie(
-        key="session_token",
-        value=session_token,
-        httponly=True,
-        secure=True,
-        samesite="none",
-        max_age=7 * 24 * 60 * 60,
-        path="/"
-    )
+    session_token = await create_session(user)
+    set_session_cookie(response, session_token)
     
     redirect_url = f"{FRONTEND_URL}/#session_id={session_token}"
     return RedirectResponse(url=redirect_url)
@@ -756,108 +3336,813 @@ async def get_me(request: Request):
 @api_router.post("/auth/logout")
 async def logout(request: Request, response: Response):
     session_token = request.cookies.get("session_token")
-    if session_token:
+    if session_token and session_token.startswith(DB_SESSION_PREFIX):
         await db.user_sessions.delete_one({"session_token": session_token})
+        invalidate_session(session_token)
+    elif session_token:
+        await revoke_session_token(session_token)
     
     response.delete_cookie(key="session_token", path="/", samesite="none", secure=True)
     return {"message": "Logged out successfully"}
 
+@api_router.post("/auth/logout/all")
+async def logout_everywhere(response: Response, user: dict = Depends(require_auth)):
+    await revoke_user_sessions(user["user_id"])
+    response.delete_cookie(key="session_token", path="/", samesite="none", secure=True)
+    return {"message": "Logged out of all sessions"}
+
+@api_router.get("/auth/pool/stats")
+async def password_pool_stats():
+    return password_pool.stats()
+
+@api_router.get("/auth/cache/stats")
+async def auth_cache_stats():
+    return {
+        "sessions": session_cache.stats(),
+        "users": user_cache.stats(),
+        "revocations": {
+            "mode": SESSION_MODE,
+            "sessions": len(revoked_sessions),
+            "users": len(revoked_generations),
+            "synced_at": revocations_synced_at
+        }
+    }
+
 @api_router.get("/movements")
-async def get_movements():
+async def get_movements(request: Request):
     try:
-        movements = await db.art_movements.find({}).to_list(length=None)
-        # Convert ObjectId to string for JSON serialization
-        for movement in movements:
-            if "_id" in movement:
-                movement["_id"] = str(movement["_id"])
-        return movements
+        return await catalog_response("art_movements", request)
     except Exception as e:
         logger.error(f"Error fetching movements: {e}")
         raise HTTPException(status_code=500, detail="Failed to fetch movements")
 
 @api_router.get("/shop/tools")
-async def get_shop_tools():
+async def get_shop_tools(request: Request):
     try:
-        tools = await db.tools.find({}).to_list(length=None)
-        # Convert ObjectId to string for JSON serialization
-        for tool in tools:
-            if "_id" in tool:
-                tool["_id"] = str(tool["_id"])
-        return tools
+        return await catalog_response("tools", request)
     except Exception as e:
         logger.error(f"Error fetching tools: {e}")
         raise HTTPException(status_code=500, detail="Failed to fetch tools")
 
+# Idempotency keys ride on the user doc, bounded to the most recent few
+PURCHASE_KEY_HISTORY = 20
+
+@api_router.post("/shop/purchase/{tool_id}", response_model=PurchaseResponse)
+async def purchase_tool(tool_id: str, request: Request, user: dict = Depends(require_auth)):
+    tool = tool_catalog.get(tool_id)
+    if not tool:
+        raise HTTPException(status_code=404, detail="Tool not found")
+    price = tool.get("price", 0)
+    idempotency_key = request.headers.get("Idempotency-Key")
+    
+    # One conditional write: enough coins, not owned yet, key not seen - no read, no transaction
+    query = {"user_id": user["user_id"], "coins": {"$gte": price}, "inventory.tool_id": {"$ne": tool_id}}
+    update: Dict[str, Any] = {
+        "$inc": {"coins": -price},
+        "$push": {"inventory": {"tool_id": tool_id, "acquired": datetime.now(timezone.utc).isoformat()}}
+    }
+    if idempotency_key:
+        query["purchase_keys"] = {"$ne": idempotency_key}
+        update["$push"]["purchase_keys"] = {"$each": [idempotency_key], "$slice": -PURCHASE_KEY_HISTORY}
+    
+    updated = await db.users.find_one_and_update(
+        query,
+        update,
+        projection={"_id": 0, "coins": 1, "inventory.tool_id": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if updated:
+        invalidate_user(user["user_id"])
+        # Stats and achievements don't need to hold up the response
+        spawn_background(stats_on_purchase(user["user_id"], len(updated.get("inventory", []))))
+        return PurchaseResponse(tool_id=tool_id, coins=updated["coins"])
+    
+    # Only the failure path pays for a read, to say why
+    current = await db.users.find_one(
+        {"user_id": user["user_id"]},
+        {"_id": 0, "coins": 1, "inventory.tool_id": 1, "purchase_keys": 1}
+    )
+    if not current:
+        raise HTTPException(status_code=404, detail="User not found")
+    if idempotency_key and idempotency_key in current.get("purchase_keys", []):
+        return PurchaseResponse(tool_id=tool_id, coins=current.get("coins", 0), replayed=True)
+    if any(item.get("tool_id") == tool_id for item in current.get("inventory", [])):
+        raise HTTPException(status_code=409, detail="Tool already owned")
+    raise HTTPException(status_code=400, detail="Not enough coins")
+
+@api_router.get("/shop/inventory")
+async def get_inventory(user: dict = Depends(require_auth)):
+    # Same user doc the purchase writes to (and the auth cache already holds)
+    inventory = []
+    for item in user.get("inventory", []):
+        tool = tool_catalog.get(item["tool_id"], {"tool_id": item["tool_id"]})
+        inventory.append({**tool, "owned": True, "acquired": item.get("acquired")})
+    return {"inventory": inventory, "coins": user.get("coins", 0)}
+
+LEADERBOARD_PROJECTION = {
+    "_id": 0, "user_id": 1, "username": 1, "level": 1, "experience": 1,
+    "total_score": 1, "avatar": 1, "artworks_count": 1
+}
+LEADERBOARD_SORT = [("total_score", DESCENDING), ("user_id", ASCENDING)]
+
+def leaderboard_entry(user: dict, rank: int) -> dict:
+    return {
+        "rank": rank,
+        "user_id": user.get("user_id"),
+        "username": user.get("username"),
+        "level": user.get("level", 1),
+        "experience": user.get("experience", 0),
+        "total_score": user.get("total_score", 0),
+        "avatar": user.get("avatar"),
+        "artworks_count": user.get("artworks_count", 0)
+    }
+
 @api_router.get("/leaderboard/global")
 async def get_global_leaderboard():
     try:
-        # Get top users by experience/level
-        pipeline = [
-            {
-                "$addFields": {
-                    "total_score": {
-                        "$add": ["$experience", {"$multiply": ["$level", 100]}]
-                    }
-                }
-            },
-            {"$sort": {"total_score": -1}},
-            {"$limit": 50}
-        ]
+        # Walks the total_score_rank index, no sort in memory
+        cursor = db.users.find({}, LEADERBOARD_PROJECTION).sort(LEADERBOARD_SORT).limit(50)
+        return await stream_json_list(cursor, lambda user, i: leaderboard_entry(user, i + 1))
+    except Exception as e:
+        logger.error(f"Error fetching global leaderboard: {e}")
+        raise HTTPException(status_code=500, detail="Failed to fetch leaderboard")
+
+@api_router.get("/leaderboard/global/me")
+async def get_my_global_rank(neighbors: int = 5, user: dict = Depends(require_auth)):
+    neighbors = max(0, min(neighbors, 25))
+    try:
+        # Read the score fresh, the cached user doc may lag a write
+        me = await db.users.find_one({"user_id": user["user_id"]}, LEADERBOARD_PROJECTION)
+        if not me:
+            raise HTTPException(status_code=404, detail="User not found")
+        score = me.get("total_score", 0)
+        user_id = me["user_id"]
+        
+        ahead = {"$or": [
+            {"total_score": {"$gt": score}},
+            {"total_score": score, "user_id": {"$lt": user_id}}
+        ]}
+        behind = {"$or": [
+            {"total_score": {"$lt": score}},
+            {"total_score": score, "user_id": {"$gt": user_id}}
+        ]}
+        
+        rank = await db.users.count_documents(ahead) + 1
+        above = await db.users.find(ahead, LEADERBOARD_PROJECTION).sort(
+            [("total_score", ASCENDING), ("user_id", DESCENDING)]
+        ).limit(neighbors).to_list(neighbors)
+        below = await db.users.find(behind, LEADERBOARD_PROJECTION).sort(LEADERBOARD_SORT).limit(neighbors).to_list(neighbors)
+        
+        return {
+            "rank": rank,
+            "user": leaderboard_entry(me, rank),
+            "above": [leaderboard_entry(u, rank - i - 1) for i, u in enumerate(above)][::-1],
+            "below": [leaderboard_entry(u, rank + i + 1) for i, u in enumerate(below)]
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error fetching user rank: {e}")
+        raise HTTPException(status_code=500, detail="Failed to fetch rank")
+
+@api_router.get("/leaderboard/movement/{movement_id}")
+async def get_movement_leaderboard(movement_id: str, limit: int = 20, cursor: Optional[str] = None):
+    limit = max(1, min(limit, 100))
+    try:
+        rank = 0
+        after = None
+        if cursor:
+            score, user_id, rank = decode_cursor(cursor, float, str, int)
+            after = (-score, user_id)
+        
+        top = await load_movement_top_k(movement_id)
+        page = [best for best in top if after is None or movement_best_key(best) > after][:limit]
         
-        users = await db.users.aggregate(pipeline).to_list(50)
+        # A full window may not hold the whole page, seek the rest from Mongo
+        if len(page) < limit and len(top) >= MOVEMENT_TOP_K:
+            last = page[-1] if page else {"score": score, "user_id": user_id}
+            page += await db.movement_bests.find(
+                movement_best_after(movement_id, last["score"], last["user_id"]),
+                MOVEMENT_BEST_PROJECTION
+            ).sort(MOVEMENT_BEST_SORT).limit(limit - len(page)).to_list(limit - len(page))
+        
+        users = await db.users.find(
+            {"user_id": {"$in": [best["user_id"] for best in page]}},
+            {"_id": 0, "user_id": 1, "username": 1, "avatar": 1, "level": 1, "artworks_count": 1}
+        ).to_list(len(page))
+        users = {u["user_id"]: u for u in users}
         
-        # Add rank
         leaderboard = []
-        for i, user in enumerate(users):
-            if "_id" in user:
-                user["_id"] = str(user["_id"])
-            entry = {
-                "rank": i + 1,
-                "user_id": user.get("user_id"),
+        for i, best in enumerate(page):
+            user = users.get(best["user_id"], {})
+            leaderboard.append({
+                "rank": rank + i + 1,
+                "user_id": best["user_id"],
                 "username": user.get("username"),
-                "level": user.get("level", 1),
-                "experience": user.get("experience", 0),
-                "total_score": user.get("total_score", 0),
                 "avatar": user.get("avatar"),
-                "artworks_count": 0  # TODO: Count actual artworks
-            }
-            leaderboard.append(entry)
+                "level": user.get("level", 1),
+                "artworks_count": user.get("artworks_count", 0),
+                "total_score": best["score"],
+                "artwork_id": best.get("artwork_id"),
+                "title": best.get("title"),
+                "thumbnail_url": thumbnail_url(best.get("artwork_id"), best.get("thumbnail")),
+                "achieved_at": best.get("achieved_at")
+            })
         
-        return leaderboard
+        # Body stays a plain list for the frontend; the seek cursor rides in a header
+        headers = {}
+        if len(page) == limit:
+            last = page[-1]
+            headers["X-Next-Cursor"] = encode_cursor(last["score"], last["user_id"], rank + len(page))
+        return FastJSONResponse(leaderboard, headers=headers)
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error fetching global leaderboard: {e}")
-        raise HTTPException(status_code=500, detail="Failed to fetch leaderboard")
+        logger.error(f"Error fetching movement leaderboard: {e}")
+        raise HTTPException(status_code=500, detail="Failed to fetch movement leaderboard")
 
-@api_router.get("/leaderboard/movement/{movement_id}")
-async def get_movement_leaderboard(movement_id: str):
+
+# Artwork endpoints
+@api_router.post("/artworks")
+async def create_artwork(artwork: ArtworkCreate = Depends(json_body(ArtworkCreate)), user: dict = Depends(require_auth)):
+    movement = await db.art_movements.find_one(
+        {"movement_id": artwork.movement_id},
+        {"_id": 0, "name": 1, "unlock_level": 1}
+    )
+    if not movement:
+        raise HTTPException(status_code=404, detail="Movement not found")
+    if user.get("level", 1) < movement.get("unlock_level", 1):
+        raise HTTPException(status_code=403, detail="Movement is locked")
+    
+    # Never trust a client-side score
+    compiled = get_compiled_movement(artwork.movement_id)
+    result = await scoring_gate.score(f"user:{user['user_id']}", artwork.canvas_data, compiled)
+    
     try:
-        # Get top scores for specific movement
-        pipeline = [
-            {"$match": {"movement_id": movement_id}},
-            {"$sort": {"score": -1}},
-            {"$limit": 20}
+        artwork_id = f"art_{uuid.uuid4().hex[:12]}"
+        now = datetime.now(timezone.utc).isoformat()
+        # json + zlib on a big canvas is tens of ms, keep it off the event loop
+        canvas_blob = await run_in_threadpool(encode_canvas, artwork.canvas_data)
+        thumbnail = thumbnail_key(canvas_blob)
+        await db.artworks.insert_one({
+            "artwork_id": artwork_id,
+            "user_id": user["user_id"],
+            "movement_id": artwork.movement_id,
+            "movement_name": movement.get("name"),
+            "title": artwork.title or "Untitled",
+            "canvas_blob": canvas_blob,
+            "preview": canvas_preview(artwork.canvas_data),
+            "thumbnail": thumbnail,
+            "score": result.total_score,
+            "breakdown": result.breakdown,
+            "feedback": result.feedback,
+            "likes": 0,
+            "views": 0,
+            "created_at": now
+        })
+        
+        new_best = await record_movement_best(artwork.movement_id, {
+            "movement_id": artwork.movement_id,
+            "user_id": user["user_id"],
+            "score": result.total_score,
+            "artwork_id": artwork_id,
+            "title": artwork.title or "Untitled",
+            "thumbnail": thumbnail,
+            "achieved_at": now
+        })
+        thumbnail_renderer.submit(thumbnail, canvas_blob)
+        
+        experience_gained = ARTWORK_XP_BASE + int(result.total_score // 10)
+        updated = await award_experience(user["user_id"], experience=experience_gained, artworks=1)
+        level = (updated or user).get("level", 1)
+        unlocked = await stats_on_artwork(user["user_id"], artwork.movement_id, result.total_score, level)
+    except Exception as e:
+        logger.error(f"Error saving artwork: {e}")
+        raise HTTPException(status_code=500, detail="Failed to save artwork")
+    
+    return {
+        "artwork_id": artwork_id,
+        "score": result.total_score,
+        "breakdown": result.breakdown,
+        "feedback": result.feedback,
+        "bonus": result.bonus,
+        "experience_gained": experience_gained,
+        "level": level,
+        "new_best": new_best,
+        "achievements_unlocked": [
+            {"achievement_id": a["achievement_id"], "name": a.get("name"), "reward": a.get("reward", 0)}
+            for a in unlocked
+        ],
+        "thumbnail_url": thumbnail_url(artwork_id, thumbnail)
+    }
+
+
+# Everything a gallery card needs; canvas payloads stay out of listings
+GALLERY_PROJECTION = {
+    "_id": 0, "artwork_id": 1, "user_id": 1, "movement_id": 1, "movement_name": 1, "title": 1,
+    "score": 1, "likes": 1, "views": 1, "created_at": 1, "preview": 1, "thumbnail": 1
+}
+GALLERY_SORT = [("created_at", DESCENDING), ("artwork_id", DESCENDING)]
+
+@api_router.get("/artworks/gallery/{user_id}")
+async def get_gallery(user_id: str, limit: int = 30, cursor: Optional[str] = None):
+    limit = max(1, min(limit, 100))
+    query: Dict[str, Any] = {"user_id": user_id}
+    if cursor:
+        created_at, artwork_id = decode_cursor(cursor, str, str)
+        query["$or"] = [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "artwork_id": {"$lt": artwork_id}}
         ]
+    
+    def render(artwork: dict, _) -> dict:
+        artwork["thumbnail_url"] = thumbnail_url(artwork["artwork_id"], artwork.pop("thumbnail", None))
+        return artwork
+    
+    def next_cursor(last: Optional[dict], count: int) -> bytes:
+        # Same {artworks, next_cursor} shape, the cursor is just written after the list
+        value = encode_cursor(last["created_at"], last["artwork_id"]) if count == limit else None
+        return b',"next_cursor":' + dumps_json(value) + b"}"
+    
+    try:
+        cursor = db.artworks.find(query, GALLERY_PROJECTION).sort(GALLERY_SORT).limit(limit)
+        return await stream_json_list(cursor, render, b'{"artworks":', next_cursor)
+    except Exception as e:
+        logger.error(f"Error fetching gallery: {e}")
+        raise HTTPException(status_code=500, detail="Failed to fetch gallery")
+
+@api_router.get("/artworks/thumbnails/stats")
+async def thumbnail_stats():
+    return thumbnail_renderer.stats()
+
+@api_router.get("/artworks/{artwork_id}/thumbnail")
+async def get_artwork_thumbnail(artwork_id: str, request: Request):
+    artwork = await db.artworks.find_one({"artwork_id": artwork_id}, {"_id": 0, "thumbnail": 1})
+    if not artwork:
+        raise HTTPException(status_code=404, detail="Artwork not found")
+    
+    key = artwork.get("thumbnail")
+    if key and etag_matches(request.headers.get("If-None-Match"), f'"{key}"'):
+        return Response(status_code=304, headers={"ETag": f'"{key}"', "Cache-Control": THUMBNAIL_CACHE_CONTROL})
+    
+    body = None
+    if key and thumbnail_path(key).exists():
+        body = await run_in_threadpool(thumbnail_path(key).read_bytes)
+    else:
+        # Not rendered yet (or rendered on another host) - load the canvas and render now
+        source = await db.artworks.find_one({"artwork_id": artwork_id}, {"_id": 0, "canvas_blob": 1, "canvas_data": 1})
+        canvas_blob = source.get("canvas_blob")
+        if canvas_blob is None:
+            # Saved before the codec
+            canvas_blob = await run_in_threadpool(encode_canvas, source.get("canvas_data") or {})
+        if key is None:
+            key = thumbnail_key(canvas_blob)
+            await db.artworks.update_one({"artwork_id": artwork_id}, {"$set": {"thumbnail": key}})
+        try:
+            body = await thumbnail_renderer.render(key, canvas_blob)
+        except Exception as e:
+            logger.error(f"Thumbnail render failed for {artwork_id}: {e}")
+            raise HTTPException(status_code=500, detail="Failed to render thumbnail")
+    
+    return Response(
+        content=body,
+        media_type=THUMBNAIL_MEDIA_TYPE,
+        headers={"ETag": f'"{key}"', "Cache-Control": THUMBNAIL_CACHE_CONTROL}
+    )
+
+@api_router.post("/artworks/{artwork_id}/like")
+async def like_artwork(artwork_id: str, user: dict = Depends(require_auth)):
+    try:
+        # The unique (artwork_id, user_id) index makes a second like a no-op
+        await db.artwork_likes.insert_one({
+            "artwork_id": artwork_id,
+            "user_id": user["user_id"],
+            "created_at": datetime.now(timezone.utc).isoformat()
+        })
+    except DuplicateKeyError:
+        artwork = await db.artworks.find_one({"artwork_id": artwork_id}, {"_id": 0, "likes": 1})
+        if not artwork:
+            raise HTTPException(status_code=404, detail="Artwork not found")
+        return {"artwork_id": artwork_id, "liked": True, "likes": artwork.get("likes", 0)}
+    
+    artwork = await db.artworks.find_one_and_update(
+        {"artwork_id": artwork_id},
+        {"$inc": {"likes": 1}},
+        projection={"_id": 0, "user_id": 1, "likes": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if not artwork:
+        await db.artwork_likes.delete_one({"artwork_id": artwork_id, "user_id": user["user_id"]})
+        raise HTTPException(status_code=404, detail="Artwork not found")
+    
+    await stats_on_like(artwork["user_id"])
+    return {"artwork_id": artwork_id, "liked": True, "likes": artwork["likes"]}
+
+@api_router.get("/artworks/{artwork_id}")
+async def get_artwork(artwork_id: str):
+    # Detail view is the only place the canvas gets decoded
+    artwork = await db.artworks.find_one_and_update(
+        {"artwork_id": artwork_id},
+        {"$inc": {"views": 1}},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    if not artwork:
+        raise HTTPException(status_code=404, detail="Artwork not found")
+    
+    artwork["canvas_data"] = await run_in_threadpool(artwork_canvas, artwork)
+    artwork.pop("canvas_blob", None)
+    artwork["thumbnail_url"] = thumbnail_url(artwork_id, artwork.pop("thumbnail", None))
+    return artwork
+
+
+# User endpoints
+@api_router.get("/users/{user_id}/stats")
+async def get_user_stats(user_id: str):
+    user = await load_user(user_id)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    stats = await db.user_stats.find_one({"user_id": user_id}, USER_STATS_PROJECTION) or {}
+    
+    artworks_count = stats.get("artworks_count", 0)
+    movements = stats.get("movements", {})
+    return {
+        "user_id": user_id,
+        "username": user.get("username"),
+        "level": user.get("level", 1),
+        "experience": user.get("experience", 0),
+        "coins": user.get("coins", 0),
+        "total_artworks": artworks_count,
+        "average_score": stats.get("score_sum", 0) / artworks_count if artworks_count else 0,
+        "best_score": stats.get("best_score", 0),
+        "total_likes": stats.get("likes_received", 0),
+        "movements_tried": len(movements),
+        "movements": movements,
+        # No stats doc yet means nothing but the starter kit
+        "tools_owned": stats.get("tools_owned", len(user.get("inventory", []))),
+        "tools_purchased": stats.get("tools_purchased", 0)
+    }
+
+@api_router.post("/users/me/stats/rebuild")
+async def rebuild_my_stats(user: dict = Depends(require_auth)):
+    try:
+        await rebuild_user_stats(user["user_id"])
+    except Exception as e:
+        logger.error(f"Error rebuilding stats for {user['user_id']}: {e}")
+        raise HTTPException(status_code=500, detail="Failed to rebuild stats")
+    return await get_user_stats(user["user_id"])
+
+
+# Achievement endpoints
+@api_router.get("/achievements/user/{user_id}")
+async def get_user_achievements(user_id: str):
+    try:
+        granted = await db.user_achievements.find(
+            {"user_id": user_id}, {"_id": 0, "achievement_id": 1, "unlocked_at": 1}
+        ).to_list(length=None)
+        stats = await db.user_stats.find_one({"user_id": user_id}, {"_id": 0}) or {}
+    except Exception as e:
+        logger.error(f"Error fetching achievements: {e}")
+        raise HTTPException(status_code=500, detail="Failed to fetch achievements")
+    
+    unlocked_at = {g["achievement_id"]: g.get("unlocked_at") for g in granted}
+    achievements = []
+    for achievement in achievement_catalog.values():
+        requirement = achievement.get("requirement") or {}
+        progress = {
+            counter: ACHIEVEMENT_COUNTERS[counter](stats)
+            for counter in requirement if counter in ACHIEVEMENT_COUNTERS
+        }
+        achievements.append({
+            **achievement,
+            "unlocked": achievement["achievement_id"] in unlocked_at,
+            "unlocked_at": unlocked_at.get(achievement["achievement_id"]),
+            "progress": progress
+        })
+    return achievements
+
+
+# Challenge endpoints
+@api_router.get("/challenges/today")
+async def get_today_challenge(request: Request):
+    _, body, etag = await get_daily_challenge(challenge_day())
+    # Good until midnight UTC; clients revalidate with the ETag after that
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={seconds_until_midnight()}"}
+    if etag_matches(request.headers.get("If-None-Match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@api_router.post("/challenges/today/submit")
+async def submit_challenge(submission: ChallengeSubmission = Depends(json_body(ChallengeSubmission)), user: dict = Depends(require_auth)):
+    day = challenge_day()
+    challenge, _, _ = await get_daily_challenge(day)
+    
+    objects = submission.canvas_data.get("objects") or []
+    if len(objects) > challenge["max_objects"]:
+        raise HTTPException(status_code=400, detail=f"Challenge allows at most {challenge['max_objects']} objects")
+    
+    compiled = compile_scoring_rules(challenge["movement_id"], challenge["scoring_rules"])
+    result = await scoring_gate.score(f"user:{user['user_id']}", submission.canvas_data, compiled)
+    
+    # Keep each user's best of the day; a lower score collides with the unique index
+    improved = True
+    try:
+        await db.challenge_entries.update_one(
+            {"date": day, "user_id": user["user_id"], "score": {"$lt": result.total_score}},
+            {"$set": {"score": result.total_score, "submitted_at": datetime.now(timezone.utc).isoformat()}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        improved = False
+    
+    entry = await db.challenge_entries.find_one({"date": day, "user_id": user["user_id"]}, {"_id": 0, "score": 1})
+    best = entry["score"] if entry else result.total_score
+    rank = await db.challenge_entries.count_documents({"date": day, "$or": [
+        {"score": {"$gt": best}},
+        {"score": best, "user_id": {"$lt": user["user_id"]}}
+    ]}) + 1
+    
+    return {
+        "challenge_id": challenge["challenge_id"],
+        "score": result.total_score,
+        "breakdown": result.breakdown,
+        "feedback": result.feedback,
+        "bonus": result.bonus,
+        "best_score": best,
+        "improved": improved,
+        "rank": rank
+    }
+
+@api_router.get("/challenges/{day}/leaderboard")
+async def get_challenge_leaderboard(day: str, limit: int = 20, cursor: Optional[str] = None):
+    if day == "today":
+        day = challenge_day()
+    limit = max(1, min(limit, 100))
+    query: Dict[str, Any] = {"date": day}
+    rank = 0
+    if cursor:
+        score, user_id, rank = decode_cursor(cursor, float, str, int)
+        query["$or"] = [{"score": {"$lt": score}}, {"score": score, "user_id": {"$gt": user_id}}]
+    
+    try:
+        entries = await db.challenge_entries.find(query, {"_id": 0}).sort(
+            [("score", DESCENDING), ("user_id", ASCENDING)]
+        ).limit(limit).to_list(limit)
+        users = await db.users.find(
+            {"user_id": {"$in": [e["user_id"] for e in entries]}},
+            {"_id": 0, "user_id": 1, "username": 1, "avatar": 1, "level": 1}
+        ).to_list(len(entries))
         
-        # For now, return empty since we don't have artworks collection implemented
-        # TODO: Implement when artworks collection is ready
-        return []
+        users = {u["user_id"]: u for u in users}
+        headers = {}
+        if len(entries) == limit:
+            last = entries[-1]
+            headers["X-Next-Cursor"] = encode_cursor(last["score"], last["user_id"], rank + len(entries))
+        return FastJSONResponse([
+            {
+                "rank": rank + i + 1,
+                "user_id": e["user_id"],
+                "username": users.get(e["user_id"], {}).get("username"),
+                "avatar": users.get(e["user_id"], {}).get("avatar"),
+                "level": users.get(e["user_id"], {}).get("level", 1),
+                "total_score": e["score"],
+                "submitted_at": e.get("submitted_at")
+            }
+            for i, e in enumerate(entries)
+        ], headers=headers)
     except Exception as e:
-        logger.error(f"Error fetching movement leaderboard: {e}")
-        raise HTTPException(status_code=500, detail="Failed to fetch movement leaderboard")
+        logger.error(f"Error fetching challenge leaderboard: {e}")
+        raise HTTPException(status_code=500, detail="Failed to fetch challenge leaderboard")
+
+
+# Scoring endpoints
+@api_router.post("/score/calculate", response_model=ScoreResponse)
+async def score_calculate(request: Request, score_request: ScoreRequest = Depends(json_body(ScoreRequest))):
+    compiled = get_compiled_movement(score_request.movement_id)
+    return await scoring_gate.score(await scoring_client(request), score_request.canvas_data, compiled)
+
+@api_router.post("/score/batch", response_model=List[ScoreResponse])
+async def score_batch(batch: ScoreBatchRequest = Depends(json_body(ScoreBatchRequest, SCORE_BATCH_MAX_BYTES)), user: dict = Depends(require_auth)):
+    if len(batch.items) > SCORE_BATCH_LIMIT:
+        raise HTTPException(status_code=413, detail=f"Batch too large (max {SCORE_BATCH_LIMIT} canvases)")
+    
+    compiled = {item.movement_id: get_compiled_movement(item.movement_id) for item in batch.items}
+    items = [(item.canvas_data, compiled[item.movement_id]) for item in batch.items]
+    try:
+        return await scoring_gate.score_batch(f"user:{user['user_id']}", items)
+    except ValueError as e:
+        logger.error(f"Batch scoring failed: {e}")
+        raise HTTPException(status_code=400, detail=f"Invalid canvas data in batch, {e}")
+
+@api_router.get("/score/cache/stats")
+async def score_cache_stats():
+    return score_cache.stats()
+
+@api_router.get("/score/gate/stats")
+async def score_gate_stats():
+    return scoring_gate.stats()
+
+@api_router.post("/score/sessions", response_model=ScoreSessionResponse)
+async def create_score_session(body: ScoreSessionCreate = Depends(json_body(ScoreSessionCreate)), user: dict = Depends(require_auth)):
+    compiled = get_compiled_movement(body.movement_id)
+    try:
+        # Seeding walks every object, so it queues for a worker like any other scoring
+        session = await scoring_gate.submit(f"user:{user['user_id']}", seed_scoring_session, user["user_id"], compiled, body.canvas_data)
+        score = session.score()
+    except (KeyError, TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid canvas data: {e}")
+    
+    store_scoring_session(session)
+    return ScoreSessionResponse(session_id=session.session_id, version=session.version, score=score)
+
+@api_router.post("/score/sessions/{session_id}/delta", response_model=ScoreSessionResponse)
+async def apply_score_delta(session_id: str, delta: ScoreSessionDelta = Depends(json_body(ScoreSessionDelta)), user: dict = Depends(require_auth)):
+    session = get_scoring_session(session_id, user["user_id"])
+    async with session.lock:
+        if delta.base_version is not None and delta.base_version != session.version:
+            raise HTTPException(status_code=409, detail="Session out of sync, resend full canvas")
+        try:
+            await scoring_gate.submit(f"user:{user['user_id']}", update_scoring_session, session, delta)
+        except (TypeError, ValueError) as e:
+            raise HTTPException(status_code=400, detail=f"Invalid canvas delta: {e}")
+        except KeyError as e:
+            # Aggregates may be half-applied, make the client start over
+            scoring_sessions.pop(session_id, None)
+            raise HTTPException(status_code=409, detail=f"Session out of sync: {e.args[0]}")
+        
+        return ScoreSessionResponse(session_id=session.session_id, version=session.version, score=session.score())
+
+@api_router.delete("/score/sessions/{session_id}")
+async def close_score_session(session_id: str, user: dict = Depends(require_auth)):
+    get_scoring_session(session_id, user["user_id"])
+    scoring_sessions.pop(session_id, None)
+    return {"message": "Scoring session closed"}
+
+
+# Live scoring channel
+# Client -> server:
+#   {"type": "canvas", "movement_id": "...", "canvas_data": {...}, "seq": 1}   full state, latest wins
+#   {"type": "delta", "ops": [{"op": "add", "id": "...", "object": {...}}], "seq": 2}
+# Server -> client:
+#   {"type": "score", "seq": 2, "score": {...}} once per burst, or {"type": "error", "detail": "..."}
+@api_router.websocket("/ws/score")
+async def live_score_ws(websocket: WebSocket):
+    # Auth once at connect. Browsers can't set headers on a WebSocket, so also accept ?token=<jwt>
+    user = await get_current_user(websocket)
+    if not user and websocket.query_params.get("token"):
+        user_id = verify_jwt_token(websocket.query_params["token"])
+        if user_id:
+            user = await load_user(user_id)
+    if not user:
+        await websocket.close(code=1008)
+        return
+    
+    await websocket.accept()
+    client = f"user:{user['user_id']}"
+    loop = asyncio.get_running_loop()
+    dirty = asyncio.Event()
+    # Sessions are built, updated and scored on worker threads; the lock keeps that one at a time
+    lock = asyncio.Lock()
+    state = {"movement_id": None, "pending_canvas": None, "session": None, "seq": None}
+    
+    def materialize_session() -> Optional[ScoringSession]:
+        # Only the last full canvas of a burst ever gets turned into a session
+        canvas = state["pending_canvas"]
+        if canvas is not None:
+            state["pending_canvas"] = None
+            state["session"] = seed_scoring_session(user["user_id"], get_compiled_movement(state["movement_id"]), canvas)
+        return state["session"]
+    
+    def score_session() -> tuple:
+        session = materialize_session()
+        return session, session.score() if session is not None else None
+    
+    def apply_delta(ops: List[CanvasDelta]):
+        session = materialize_session()
+        if session is None:
+            raise KeyError("no canvas yet")
+        session.apply_ops(ops)
+    
+    async def submit_live(fn: Callable, *args, cost: int = 1) -> Any:
+        # Same admission as HTTP scoring, but a live client is backpressured rather than refused
+        while True:
+            try:
+                return await scoring_gate.submit(client, fn, *args, cost=cost)
+            except HTTPException as e:
+                if e.status_code != 429:
+                    raise
+                await asyncio.sleep(float(e.headers["Retry-After"]))
+    
+    async def scorer():
+        while True:
+            await dirty.wait()
+            started = loop.time()
+            while True:
+                dirty.clear()
+                remaining = WS_SCORE_MAX_DELAY - (loop.time() - started)
+                if remaining <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(dirty.wait(), timeout=min(WS_SCORE_DEBOUNCE, remaining))
+                except asyncio.TimeoutError:
+                    break
+            
+            async with lock:
+                try:
+                    session, score = await submit_live(score_session)
+                except (KeyError, TypeError, ValueError) as e:
+                    state["session"] = None
+                    state["pending_canvas"] = None
+                    await websocket.send_json({"type": "error", "detail": f"Invalid canvas data: {e}", "resync": True})
+                    continue
+            if session is not None:
+                await websocket.send_json({"type": "score", "seq": state["seq"], "version": session.version, "score": score.model_dump()})
+    
+    scorer_task = asyncio.create_task(scorer())
+    try:
+        while True:
+            frame = await websocket.receive()
+            if frame["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(frame.get("code", 1000))
+            raw = frame.get("text") or frame.get("bytes") or ""
+            if len(raw) > CANVAS_MAX_BYTES:
+                await websocket.send_json({"type": "error", "detail": f"Message too large (max {CANVAS_MAX_BYTES} bytes)"})
+                continue
+            try:
+                message = LiveScoreMessage.model_validate_json(raw)
+            except ValidationError as e:
+                await websocket.send_json({"type": "error", "detail": e.errors(include_url=False, include_input=False)})
+                continue
+            
+            if message.type == "canvas":
+                movement_id = message.movement_id or state["movement_id"]
+                if not movement_id or message.canvas_data is None:
+                    await websocket.send_json({"type": "error", "detail": "canvas needs movement_id and canvas_data"})
+                    continue
+                async with lock:
+                    state["movement_id"] = movement_id
+                    state["pending_canvas"] = message.canvas_data
+                    state["session"] = None
+            
+            else:
+                async with lock:
+                    try:
+                        # Deltas are cheap, only the seeding of a pending full canvas is charged
+                        await submit_live(apply_delta, message.ops, cost=int(state["pending_canvas"] is not None))
+                    except (KeyError, TypeError, ValueError) as e:
+                        state["session"] = None
+                        state["pending_canvas"] = None
+                        await websocket.send_json({"type": "error", "detail": f"Session out of sync: {e}", "resync": True})
+                        continue
+            
+            state["seq"] = message.seq
+            dirty.set()
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logger.error(f"Live scoring channel error: {e}")
+    finally:
+        scorer_task.cancel()
+
 
 
 # Diğer endpointler devam ediyor...
 # (Karakter sınırı nedeniyle kesildi)
 
+async def timed_phase(name: str, coro):
+    started = time.perf_counter()
+    result = await coro
+    logger.info(f"Startup phase {name} took {(time.perf_counter() - started) * 1000:.1f}ms")
+    return result
+
 @app.on_event("startup")
 async def startup_event():
-    await initialize_art_movements()
-    await initialize_tools()
-    await initialize_achievements()
-    logger.info("Chromatic Arena API initialized!")
+    started = time.perf_counter()
+    # Indexes first so the seed upserts hit the unique id indexes
+    await timed_phase("indexes", ensure_indexes())
+    await timed_phase("seed", initialize_default_data())
+    await timed_phase("achievements", load_achievements())
+    await timed_phase("migrations", run_migrations())
+    await timed_phase("tools", load_tool_catalog())
+    await timed_phase("scoring_rules", load_scoring_rules())
+    await timed_phase("revocations", sync_revocations())
+    app.state.movement_watcher = asyncio.create_task(watch_movement_changes())
+    app.state.tool_watcher = asyncio.create_task(watch_tool_changes())
+    app.state.challenge_roller = asyncio.create_task(roll_daily_challenges())
+    app.state.revocation_sync = asyncio.create_task(watch_session_revocations())
+    THUMBNAIL_DIR.mkdir(parents=True, exist_ok=True)
+    thumbnail_renderer.start()
+    logger.info(f"Chromatic Arena API initialized in {(time.perf_counter() - started) * 1000:.1f}ms!")
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    password_pool.shutdown()
+    scoring_gate.shutdown()
+    thumbnail_renderer.shutdown()
+    app.state.movement_watcher.cancel()
+    app.state.tool_watcher.cancel()
+    app.state.challenge_roller.cancel()
+    app.state.revocation_sync.cancel()
     client.close()
 
 app.include_router(api_router)
@@ -11,10 +11,14 @@ export const useGameStore = create((set, get) => ({
   
   currentCanvas: null,
   currentScore: null,
+  // Set from Retry-After when scoring is throttled; until then the last score stays on screen
+  scoreRetryAt: 0,
   
   tools: [],
   inventory: [],
   selectedTool: null,
+  // Idempotency key per tool until the server gives a definite answer, so retries and double clicks replay it
+  pendingPurchases: {},
   
   leaderboard: [],
   achievements: [],
@@ -41,13 +45,30 @@ export const useGameStore = create((set, get) => ({
     set({ currentCanvas: canvas });
   },
   
-  calculateScore: async (canvasData, movementId) => {
+  calculateScore: async (canvasData, movementId, token) => {
+    if (Date.now() < get().scoreRetryAt) {
+      return get().currentScore;
+    }
     try {
+      // Signed-in requests are rate limited per user instead of per address
       const res = await fetch(`${API}/score/calculate`, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: {
+          'Content-Type': 'application/json',
+          ...(token && { 'Authorization': `Bearer ${token}` })
+        },
+        credentials: 'include',
         body: JSON.stringify({ canvas_data: canvasData, movement_id: movementId })
       });
+      if (!res.ok) {
+        // Error bodies aren't scores; keep the last one and back off if the server asked us to
+        const retryAfter = Number(res.headers.get('Retry-After'));
+        if (retryAfter > 0) {
+          set({ scoreRetryAt: Date.now() + retryAfter * 1000 });
+        }
+        console.error('Failed to calculate score:', res.status);
+        return get().currentScore;
+      }
       const data = await res.json();
       set({ currentScore: data });
       return data;
@@ -116,12 +137,30 @@ export const useGameStore = create((set, get) => ({
   },
   
   purchaseTool: async (toolId, token) => {
+    let idempotencyKey = get().pendingPurchases[toolId];
+    if (!idempotencyKey) {
+      idempotencyKey = crypto.randomUUID();
+      set((state) => ({ pendingPurchases: { ...state.pendingPurchases, [toolId]: idempotencyKey } }));
+    }
+    const settle = () => set((state) => {
+      const { [toolId]: _, ...rest } = state.pendingPurchases;
+      return { pendingPurchases: rest };
+    });
+    
     try {
       const res = await fetch(`${API}/shop/purchase/${toolId}`, {
         method: 'POST',
         credentials: 'include',
-        headers: token ? { 'Authorization': `Bearer ${token}` } : {}
+        headers: {
+          // Same key for every attempt at this purchase; a replay of it is never charged twice
+          'Idempotency-Key': idempotencyKey,
+          ...(token && { 'Authorization': `Bearer ${token}` })
+        }
       });
+      // A definite answer ends this purchase; network and server errors keep the key for the retry
+      if (res.status < 500) {
+        settle();
+      }
       
       if (!res.ok) {
         const error = await res.json();
@@ -130,8 +169,8 @@ export const useGameStore = create((set, get) => ({
       
       const data = await res.json();
       
-      // Refresh tools list
-      await get().fetchTools();
+      // Refresh tools list and what we own
+      await Promise.all([get().fetchTools(), get().fetchInventory(token)]);
       
       return data;
     } catch (error) {
@@ -65,9 +65,9 @@ export default function AtelierPage() {
 
   const handleScoreUpdate = useCallback((canvasData) => {
     if (selectedMovement) {
-      calculateScore(canvasData, selectedMovement.movement_id);
+      calculateScore(canvasData, selectedMovement.movement_id, token);
     }
-  }, [selectedMovement, calculateScore]);
+  }, [selectedMovement, calculateScore, token]);
 
   const handleSave = (canvasData) => {
     setPendingCanvasData(canvasData);
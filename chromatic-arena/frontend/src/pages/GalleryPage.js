@@ -139,9 +139,9 @@ export default function GalleryPage() {
                     className="aspect-square relative"
                     style={{
                       background: `linear-gradient(135deg, ${
-                        artwork.canvas_data?.backgroundColor || '#f0f0f0'
+                        artwork.preview?.background || '#f0f0f0'
                       } 0%, ${
-                        artwork.canvas_data?.objects?.[0]?.fill || '#e0e0e0'
+                        artwork.preview?.accent || '#e0e0e0'
                       } 100%)`
                     }}
                   >
@@ -12,17 +12,19 @@ import { toast } from 'sonner';
 
 export default function ShopPage() {
   const { user } = useAuth();
-  const { tools, fetchTools, purchaseTool } = useGameStore();
+  const { tools, inventory, fetchTools, fetchInventory, purchaseTool } = useGameStore();
   const [loading, setLoading] = useState(true);
   const [purchasing, setPurchasing] = useState(null);
 
   useEffect(() => {
     const loadShop = async () => {
-      await fetchTools();
+      await Promise.all([fetchTools(), fetchInventory(localStorage.getItem('token'))]);
       setLoading(false);
     };
     loadShop();
-  }, [fetchTools]);
+  }, [fetchTools, fetchInventory]);
+
+  const ownedToolIds = new Set(inventory.map((item) => item.tool_id));
 
   const handlePurchase = async (tool) => {
     if ((user?.coins || 0) < tool.price) {
@@ -102,7 +104,7 @@ export default function ShopPage() {
             <div className="grid grid-cols-1 sm:grid-cols-2 lg:grid-cols-3 gap-6">
               {tools.map((item, index) => {
                 const Icon = getIconComponent(item.icon);
-                const isPurchased = item.owned;
+                const isPurchased = item.owned || ownedToolIds.has(item.tool_id);
                 const isPurchasing = purchasing === item.tool_id;
                 
                 return (